@@ -1,13 +1,260 @@
-import json
+import itertools
 import logging
 
 from yao import garblerSocket
-from util.util import write_to_file, copy_and_expand_list
+from util.util import BITWISE_COMPARATOR, CARRY_COMPARATOR, CLASSIC, LINEAR_TOPOLOGY, PACKED_SCHEMES, TREE_TOPOLOGY
+from util.util import dump_json, copy_and_expand_list
 from yao import ot
+from yao.circuitCache import CircuitCache
 from yao.yaoGarbler import YaoGarbler
 
 
-class Alice(YaoGarbler):
+class MaxCircuitBuilder:
+    """Builder of the max circuit, from the generators of its gates.
+
+    It needs no socket and garbles nothing, Alice is a MaxCircuitBuilder, and
+    the benchmarks build their circuits with one.
+
+    Args:
+        comparator: Optional; the comparators of the max circuit,
+            BITWISE_COMPARATOR or CARRY_COMPARATOR (BITWISE_COMPARATOR by
+            default).
+    """
+
+    def __init__(self, comparator=BITWISE_COMPARATOR):
+        if comparator not in (BITWISE_COMPARATOR, CARRY_COMPARATOR):
+            raise ValueError(f"Unknown comparator {comparator}")
+        self.comparator = comparator
+
+    def max_circuit(self, topology, input_set_length, bit_rep_length):
+        """
+        Method to build the max circuit, without writing it anywhere. The gates come from the generator of
+        max_gates, but they are all collected in the list of the circuit, which the cache, the garbler and bob need
+        as a whole
+
+        Args:
+            topology: how the comparators are connected, see Alice.create_max_cicruit
+            input_set_length: the agreed number of inputs
+            bit_rep_length: the agreed bit representation length for each input
+
+        Returns:
+            the dictionary of the max circuit, with its id, the wires of alice and bob, the outputs and the gates
+        """
+        # Alice input gates from 1 to input_set_length * bit_rep_length, then Bob's, each number is a range of
+        # bit_rep_length consecutive gate indexes
+        alice_end = input_set_length * bit_rep_length + 1
+        bob_end = input_set_length * bit_rep_length * 2 + 1
+        alice = [range(i, i + bit_rep_length) for i in range(1, alice_end, bit_rep_length)]
+        bob = [range(i, i + bit_rep_length) for i in range(alice_end, bob_end, bit_rep_length)]
+
+        gates, outputs = collect_gates(self.max_gates(alice, bob, bob_end, topology))
+
+        return {
+            "id": "max_value",
+            "alice": list(range(1, alice_end)),
+            "bob": list(range(alice_end, bob_end)),
+            "out": outputs,
+            "gates": gates,
+        }
+
+    def max_gates(self, alice, bob, index, topology=LINEAR_TOPOLOGY):
+        """
+        This generator yields the gates of the max circuit one by one, so that they can be consumed without holding
+        them all, and returns the list of indexes of the max number
+        Args:
+            alice: Alice's numbers, each one represented as a range of gate indexes
+            bob: Bob's numbers, each one represented as a range of gate indexes
+            index: progressive index, for the gate IDs, the ID of the first gate
+            topology: Optional; how the comparators are connected, see Alice.create_max_cicruit
+        """
+        if topology == TREE_TOPOLOGY:
+            # Compare the inputs pairwise, then the results pairwise and so on, the depth grows as log(inputs)
+            return (yield from self.tournament_tree_gates(alice + bob, index))
+
+        # Compare the first numbers of Alice and Bob, then each other number with the running max
+        outputs = yield from self.greater_gates(alice[0], bob[0], index)
+        for number in itertools.chain(itertools.islice(alice, 1, None), itertools.islice(bob, 1, None)):
+            outputs = yield from self.greater_gates(number, outputs, outputs[-1] + 1)
+        return outputs
+
+    def tournament_tree_gates(self, numbers, index):
+        """
+        This generator yields the gates of a balanced tree of comparators: the numbers are compared pairwise, then
+        the greater numbers of each pair are compared pairwise, and so on until only the max is left. A number
+        without a pair goes up to the next level as it is
+        Args:
+            numbers: the numbers to compare, each one represented as a sequence of gate indexes
+            index: progressive index, for the gate IDs, the ID of the first gate
+
+        Returns:
+            the list of indexes of the max number
+        """
+        while len(numbers) > 1:
+            winners = []
+            for first_number, second_number in zip(numbers[0::2], numbers[1::2]):
+                outputs = yield from self.greater_gates(first_number, second_number, index)
+                index = outputs[-1] + 1
+                winners.append(outputs)
+            if len(numbers) % 2 == 1:
+                winners.append(numbers[-1])
+            numbers = winners
+
+        return list(numbers[0])
+
+    def greater_gates(self, first_number, second_number, index):
+        """
+        This generator yields the gates of a single comparator circuit that gives in output the greater number
+        between the two compared bit-by-bit, for any generic n bit unsigned pair of binary numbers. The bits are
+        processed in a loop from the most significant one, keeping the running "first is greater" OR gate and the
+        running "equal so far" AND gate, so the depth of Python calls does not grow with the bit length.
+        With CARRY_COMPARATOR the gates of carry_greater_gates are yielded instead
+        Args:
+            first_number: first binary number, represented as a sequence of gate indexes
+            second_number: second binary number, represented as a sequence of gate indexes
+            index: progressive index, for the gate IDs, the ID of the first gate
+
+        Returns:
+            the list of the multiplexer output i.e. the chosen greater number, that will be the next input for the
+            next comparator in the procedure create_max_circuit, until all alice and bob inputs are compared
+        """
+        if self.comparator == CARRY_COMPARATOR:
+            return (yield from self.carry_greater_gates(first_number, second_number, index))
+
+        partial_output = None  # the OR gate of the bits so far where first_number is greater
+        carry_compared_gate = None  # the AND of the XNOR gates of the bits so far
+        last = len(first_number) - 1
+        for bit, (a0, b0) in enumerate(zip(first_number, second_number)):
+            # a0 AND NOT b0: first_number is greater on this bit
+            yield {"id": index, "type": "NOT", "in": [b0]}
+            yield {"id": index + 1, "type": "AND", "in": [a0, index]}
+            and_index = index + 1
+            index += 2
+
+            if bit < last:
+                # The XNOR of the bits is only needed by the next bits
+                yield {"id": index, "type": "XNOR", "in": [a0, b0]}
+                xnor_index = index
+                index += 1
+
+            if carry_compared_gate is None:
+                if bit == last:  # numbers of a single bit
+                    return [and_index]
+                partial_output, carry_compared_gate = and_index, xnor_index
+                continue
+
+            # Greater on this bit with all the previous bits equal, or greater on one of the previous bits
+            yield {"id": index, "type": "AND", "in": [and_index, carry_compared_gate]}
+            yield {"id": index + 1, "type": "OR", "in": [index, partial_output]}
+            partial_output = index + 1
+            index += 2
+
+            if bit < last:
+                yield {"id": index, "type": "AND", "in": [xnor_index, carry_compared_gate]}
+                carry_compared_gate = index
+                index += 1
+
+        return (yield from self.multiplexer_gates(first_number, second_number, index, partial_output))
+
+    def multiplexer_gates(self, first_number, second_number, index, partial_output):
+        """
+        This generator finalizes the outputs of greater_gates by multiplexing the comparison result into the final
+        output gates. It yields a n-bit multiplexer circuit, that, based on the final OR gate result of the greater
+        circuit, chooses the correct greater number
+        Args:
+            first_number: the first number that can be chosen
+            second_number: the second number that can be chosen
+            index: progressive index, for the gate IDs, the ID of the first gate
+            partial_output: the index of the OR gate before adding the multiplexer to choose the correct number
+
+        Returns:
+            a list containing the final n indexes of OR gates that represent the chosen greater number
+        """
+        n_bits = len(first_number)
+
+        # AND gates with the partial output and each gate from first_number
+        first_ands = range(index, index + n_bits)
+        for and_index, gate in zip(first_ands, first_number):
+            yield {"id": and_index, "type": "AND", "in": [partial_output, gate]}
+
+        # NOT gate of the partial output, then AND gates with it and each gate from second_number
+        not_index = first_ands.stop
+        yield {"id": not_index, "type": "NOT", "in": [partial_output]}
+        second_ands = range(not_index + 1, not_index + 1 + n_bits)
+        for and_index, gate in zip(second_ands, second_number):
+            yield {"id": and_index, "type": "AND", "in": [not_index, gate]}
+
+        # OR gates choosing the bits of the greater number
+        final_outputs = range(second_ands.stop, second_ands.stop + n_bits)
+        for or_index, first_and, second_and in zip(final_outputs, first_ands, second_ands):
+            yield {"id": or_index, "type": "OR", "in": [first_and, second_and]}
+
+        return list(final_outputs)
+
+    def carry_greater_gates(self, first_number, second_number, index):
+        """
+        This generator yields the gates of a comparator with a single AND gate per bit, the other gates being XOR gates,
+        free with the free-XOR schemes. From the least significant bit, it computes the carry of
+        first_number + NOT second_number, c' = a XOR ((a XOR c) AND (b XOR c)), whose last value is 1 if and only if
+        first_number is greater. The greater number is then chosen by xor_multiplexer_gates
+        Args:
+            first_number: first binary number, represented as a sequence of gate indexes
+            second_number: second binary number, represented as a sequence of gate indexes
+            index: progressive index, for the gate IDs, the ID of the first gate
+
+        Returns:
+            the list of the multiplexer output i.e. the chosen greater number, as greater_gates
+        """
+        carry = None  # the carry so far, 0 before the least significant bit
+        for a0, b0 in zip(reversed(first_number), reversed(second_number)):
+            if carry is None:
+                # a0 XOR (a0 AND b0) = a0 AND NOT b0
+                yield {"id": index, "type": "AND", "in": [a0, b0]}
+                yield {"id": index + 1, "type": "XOR", "in": [a0, index]}
+                carry = index + 1
+                index += 2
+                continue
+
+            yield {"id": index, "type": "XOR", "in": [a0, carry]}
+            yield {"id": index + 1, "type": "XOR", "in": [b0, carry]}
+            yield {"id": index + 2, "type": "AND", "in": [index, index + 1]}
+            yield {"id": index + 3, "type": "XOR", "in": [a0, index + 2]}
+            carry = index + 3
+            index += 4
+
+        return (yield from self.xor_multiplexer_gates(first_number, second_number, index, carry))
+
+    def xor_multiplexer_gates(self, first_number, second_number, index, select):
+        """
+        This generator yields a n-bit multiplexer with a single AND gate per bit, each bit of the output being
+        b XOR (select AND (a XOR b)), so first_number is chosen if select is 1 and second_number otherwise
+        Args:
+            first_number: the first number that can be chosen
+            second_number: the second number that can be chosen
+            index: progressive index, for the gate IDs, the ID of the first gate
+            select: the index of the gate choosing the number
+
+        Returns:
+            a list containing the final n indexes of XOR gates that represent the chosen number, the last one is the
+            greatest index of the multiplexer
+        """
+        n_bits = len(first_number)
+
+        differences = range(index, index + n_bits)
+        for xor_index, a0, b0 in zip(differences, first_number, second_number):
+            yield {"id": xor_index, "type": "XOR", "in": [a0, b0]}
+
+        selections = range(differences.stop, differences.stop + n_bits)
+        for and_index, difference in zip(selections, differences):
+            yield {"id": and_index, "type": "AND", "in": [select, difference]}
+
+        final_outputs = range(selections.stop, selections.stop + n_bits)
+        for xor_index, b0, selection in zip(final_outputs, second_number, selections):
+            yield {"id": xor_index, "type": "XOR", "in": [b0, selection]}
+
+        return list(final_outputs)
+
+
+class Alice(YaoGarbler, MaxCircuitBuilder):
     """Alice is the creator of the Yao circuit.
 
     Alice creates a Yao circuit and sends it to the evaluator along with her
@@ -19,14 +266,49 @@ class Alice(YaoGarbler):
     a specific order.
 
     Attributes:
-        oblivious_transfer: Optional; enable the Oblivious Transfer protocol
-            (True by default).
+        oblivious_transfer: Optional; enable the Oblivious Transfer protocol,
+            with OT_EXTENSION a few base OTs are extended to all of Bob's
+            wires, Alice and Bob must use the same mode (True by default).
+        scheme: Optional; the garbling scheme, CLASSIC, FREE_XOR, HALF_GATES,
+            FIXED_KEY or GRR3 (CLASSIC by default).
+        chunk_size: Optional; stream the garbled tables to Bob in chunks of
+            this many gates after the inputs, instead of sending them all with
+            the circuit (None by default).
+        pipelined: Optional; talk to Bob over a pipelined socket, where no
+            message waits for an acknowledgement, Alice and Bob must use the
+            same transport (False by default).
+        session_id: Optional; a string identifying this computation on an
+            evaluator server (see bob.serve), always over the pipelined
+            transport, or None to talk to a single Bob (None by default).
+        optimize: Optional; garble the circuits optimized by optimize_circuit,
+            with fewer gates (False by default).
+        pool: Optional; a GarblingPool of max circuits garbled offline by
+            garble_shape of an Alice with the same scheme, chunk_size and
+            optimize and comparator, or an ArtifactStore of circuits garbled
+            whole with the same scheme and comparator, the circuit is garbled inline only on a miss (None
+            by default).
+        pre_reduce: Optional; reduce the inputs to their max locally and
+            compare it with Bob's in a circuit of a single comparator, which
+            hides the number of inputs. Alice and Bob should use the same
+            mode, the max is still right if only one of them reduces its
+            inputs, but the circuit is sized for the other's (False by
+            default).
+        comparator: Optional; the comparators of the max circuit,
+            BITWISE_COMPARATOR, or CARRY_COMPARATOR with about a third of
+            the gates that are not free with the free-XOR schemes
+            (BITWISE_COMPARATOR by default).
     """
 
-    def __init__(self, oblivious_transfer=True):
+    circuit_cache = CircuitCache()  # built circuits, shared by every Alice of the process
+
+    def __init__(self, oblivious_transfer=True, scheme=CLASSIC, chunk_size=None, pipelined=False,
+                 session_id=None, optimize=False, pool=None, pre_reduce=False, comparator=BITWISE_COMPARATOR):
+        MaxCircuitBuilder.__init__(self, comparator)
         self.inputs, self.max_bit_length, self.input_length = [], 0, 0
-        self.socket = garblerSocket.GarblerSocket()
-        super().__init__(None)
+        self.pool = pool
+        self.pre_reduce = pre_reduce
+        self.socket = garblerSocket.GarblerSocket(pipelined=pipelined, session_id=session_id)
+        super().__init__(None, scheme, chunk_size, optimize)
         self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
 
     def read_inputs(self, input_list):
@@ -43,13 +325,17 @@ class Alice(YaoGarbler):
         it useful to not reveal to each other any information about the inputs
 
         Args:
-            input_length: the input length that alice will communicate to bob, that she wants to use
+            input_length: the input length that alice will communicate to bob, that she wants to use, 1 with
+                          pre_reduce as she only inputs her max
             max_bit_length: the maximum bit length to represent integers that alice will communicate to bob,
                             that she wants to use
 
         Returns:
             the final lengths used in the communication that both parties have agreed upon
         """
+        if self.pre_reduce:
+            input_length = 1
+
         print(f"For alice at the beginning input_length is: {str(input_length)} "
               f"and alice bit_length is: {str(max_bit_length)}")
 
@@ -69,28 +355,44 @@ class Alice(YaoGarbler):
     def send_preliminary_information(self):
         """
         Method used to send to bob some preliminary information useful to perform the oblivious transfer, such as:
-        the circuit, the garbled tables(made from the circuit) and the number of the output gates of the circuit
+        the circuit, the garbled tables(made from the circuit), the number of the output gates of the circuit
+        and the garbling scheme that bob has to use to evaluate it.
+        With a scheme that has fixed size rows the garbled tables are sent as one packed buffer, when streaming they
+        are sent later, chunk by chunk, along with the pbits of the outputs. The tables of a circuit loaded from an
+        artifact are packed already, and sent from the memory-mapped file
 
         Returns:
             the dictionary that alice sends to bob in order to set up the Oblivious Transfer correctly
         """
         for circuit in self.circuits:
+            garbled_tables = circuit["garbled_tables"]
+            if self.chunk_size is not None:
+                garbled_tables = None
+            elif circuit["scheme"] in PACKED_SCHEMES and circuit["garbled_circuit"] is not None:
+                garbled_tables = circuit["garbled_circuit"].get_packed_tables()
             to_send = {
                 "circuit": circuit["circuit"],
-                "garbled_tables": circuit["garbled_tables"],
+                "garbled_tables": garbled_tables,
                 "pbits_out": circuit["pbits_out"],
+                "scheme": circuit["scheme"],
+                "stream": self.chunk_size is not None,
             }
             logging.debug(f"Sending {circuit['circuit']['id']}")
-            self.socket.send_wait(to_send)
+            if self.socket.pipelined:
+                self.socket.send(to_send)  # Bob goes on with the inputs, no acknowledgement
+            else:
+                self.socket.send_wait(to_send)
             return to_send
 
     def compute_function(self):
         """
-        Method to compute the shared function, the max
+        Method to compute the shared function, the max, with pre_reduce on the max of alice's inputs only
 
         Returns:
             the meaningful results of the Oblivious Transfer, regarding alice and also bob
         """
+        if self.pre_reduce:
+            self.inputs = [max(self.inputs, default=0)]  # max(A + B) = max(max(A), max(B))
         self.inputs = copy_and_expand_list(self.inputs, self.input_length)
 
         for entry in self.circuits:
@@ -119,237 +421,101 @@ class Alice(YaoGarbler):
                 a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
                                         pbits[a_wires[i]] ^ bits_a[i])
 
-            # Send Alice's encrypted inputs and keys to Bob
-            result = self.ot.get_result(a_inputs, b_keys)
+            # Send Alice's encrypted inputs and keys to Bob, then the garbled tables if they are streamed
+            stream = self.stream_garbled_tables(entry) if self.chunk_size is not None else None
+            result = self.ot.get_result(a_inputs, b_keys, stream)
 
             return a_wires, bits_a, b_wires, b_keys, outputs, result
 
     def _get_encr_bits(self, pbit, key0, key1):
         return (key0, 0 ^ pbit), (key1, 1 ^ pbit)
 
-    def create_max_cicruit(self):
+    def create_max_cicruit(self, topology=LINEAR_TOPOLOGY):
         """
-        Method to create the max circuit and prepare it to be stored in a readable json format
+        Method to create the max circuit and prepare it to be stored in a readable json format. The circuit only
+        depends on the topology and on the agreed lengths, so after the first time it comes from circuit_cache,
+        in memory or on disk, and only the garbling is done again, unless the pool has it garbled already
+
+        Args:
+            topology: Optional; how the comparators are connected, LINEAR_TOPOLOGY compares each input with the
+                      running max, TREE_TOPOLOGY compares the inputs pairwise like a tournament, with the same
+                      number of gates but a depth that grows as log(inputs) instead of linearly
 
         Returns:
-            the final max circuit as a dictionary and also stores it in a JSON file inside circuits folder,
-            named total_circuit.json
+            the final max circuit as a dictionary, the JSON file circuits/total_circuit.json is only written when the
+            circuit is built
         """
-        # Initialize input and bit lengths
-        input_set_length = self.input_length  # Number of inputs
-        bit_rep_length = self.max_bit_length  # Bit representation length for each input
-        circuit = {"name": "max_circuit", "circuits": [{}]}  # Initial structure of the circuit
-
-        # Prepare inputs for Alice and Bob
-        alice = [i for i in range(1, input_set_length * bit_rep_length + 1)]  # alice input gates from 1 to n where n is input_set_length * bit_rep_length + 1
-        bob = [i for i in range(input_set_length * bit_rep_length + 1, input_set_length * bit_rep_length * 2 + 1)]  # bob input gates from alice last gate number up to input_set_length * bit_rep_length * 2 + 1
-        index = input_set_length * bit_rep_length * 2 + 1  # Initial index for gate IDs
-
-        # Create initial greater circuit comparison between first segments of Alice's and Bob's inputs
-        gates, outputs = self.greater_circuit(alice[:bit_rep_length],
-                                              bob[:bit_rep_length],
-                                              0,
-                                              [],
-                                              index)
-        # Update Alice and Bob input lists by removing the compared segment
-        alice = alice[bit_rep_length:]
-        bob = bob[bit_rep_length:]
-
-        index = outputs[-1] + 1  # Update index for next set of gates
-
-        # Iterate over remaining Alice's inputs
-        while len(alice) > 0:
-            a_inputs = alice[:bit_rep_length]  # Get next segment of Alice's inputs
-            gates_list, outputs = self.greater_circuit(a_inputs, outputs, 0, [], index)  # Compare with current outputs
-
-            gates.extend(gates_list)  # Add new gates to the main gate list
-            index = outputs[-1] + 1  # Update index
-            alice = alice[bit_rep_length:]  # Update Alice's input list removing the just compared segment
-
-        #  Iterate over remaining Bob's inputs
-        while len(bob) > 0:
-            b_inputs = bob[:bit_rep_length]  # Get next segment of Bob's inputs
-            gates_list, outputs = self.greater_circuit(b_inputs, outputs, 0, [], index)  # Compare with current outputs
-
-            gates.extend(gates_list)  # Add new gates to the main gate list
-            index = outputs[-1] + 1  # Update index
-            bob = bob[bit_rep_length:]  # Update Bob's input list
-
-        #  Finalize circuit dictionary with ids, inputs, outputs, and gates
-        circuit["circuits"][0]["id"] = "max_value"  # Set ID for the circuit
-        circuit["circuits"][0]["alice"] = [i for i in range(1, input_set_length * bit_rep_length + 1)]
-        circuit["circuits"][0]["bob"] = [i for i in range(input_set_length * bit_rep_length + 1,
-                                                          input_set_length * bit_rep_length * 2 + 1)]
-        circuit["circuits"][0]["out"] = outputs
-        circuit["circuits"][0]["gates"] = gates
-
-        # Convert circuit dictionary to JSON string
-        circuit_string = str(circuit).replace("'", '"')
-
-        # Write JSON string to file
-        json_path = 'circuits/total_circuit.json'
-        parsed_circuit = json.loads(circuit_string)
-        parsed_circuit = json.dumps(parsed_circuit, indent=4, separators=(', ', ': ')) + "\n"  # Format the string
-        write_to_file(json_path, parsed_circuit)
+        shape = (topology, self.input_length, self.max_bit_length)
+        entry = self.pool.take(shape) if self.pool is not None else None
+        if entry is not None:  # garbled offline
+            self.circuits.append(entry)
+            return {"name": "max_circuit", "circuits": [entry["circuit"]]}
+
+        circuit = {"name": "max_circuit", "circuits": [self.get_max_circuit(shape)]}
 
         # Update circuits using superclass method
         super().update_circuits(circuit)
 
         return circuit
 
-    def greater_circuit(self, first_number, second_number, input_slider, all_gates, index, partial_output=None,
-                        carry_compared_gate=None):
+    def garble_shape(self, shape):
         """
-        This method creates a single comparator circuit that gives in output the greater number between the
-        two compared bit-by-bit. It is a recursive procedure, that can create the comparator for any generic n bit
-        unsigned pair of binary numbers.
+        Method to garble a fresh max circuit of the given shape with the settings of this Alice, without adding it
+        to her circuits, it is the producer of a GarblingPool
         Args:
-            first_number: first binary number, represented as a list gate indexes
-            second_number: second binary number, represented as a list of gate indexes
-            input_slider: index to scroll the two lists
-            all_gates: all the gates created in this procedure for a single comparator of two n-bit numbers,
-                       it starts always as an empty list
-            index: progressive index, for the gate IDs, gets update every time a new gate is created
-            partial_output: the OR gate before adding the multiplexer to choose the correct number
-            carry_compared_gate: the intermediate AND of the various XNOR gates in the circuit
+            shape: the tuple (topology, input_length, bit_length) of the circuit
 
         Returns:
-            the circuit with all the gates and the list of the multiplexer output i.e. the chosen
-            greater number, that will be the next input for the next comparator in the procedure
-            create_max_circuit, until all alice and bob inputs are compared
+            the entry of the garbled circuit, to add to the circuit list of the garbler
         """
+        return self._garble(self.get_max_circuit(shape))
 
-        # Base case: if input_slider is at the last bit position
-        if input_slider == len(first_number) - 1:
-            not_index = index
-            a0 = first_number[input_slider]  # Current bit from first_number
-            b0 = second_number[input_slider]  # Current bit from second_number
-
-            # Create a NOT gate for the current bit of second_number
-            all_gates.append({"id": not_index, "type": "NOT", "in": [b0]})
-            index += 1
-
-            # Create an AND gate with the current bit of first_number and the NOT gate output
-            and_gate = {"id": index, "type": "AND", "in": [a0, not_index]}
-            all_gates.append(and_gate)
-            and_index = index
-            index += 1
-
-            if carry_compared_gate is None:
-                final_outputs = [and_gate.get("id")]
-            else:
-                # If there is the carried gate to AND then create a "final" AND gate with the previous AND gate
-                # and carry_compared_gate
-                final_and_gate = {"id": index, "type": "AND", "in": [and_index, carry_compared_gate.get("id")]}
-                final_and_gate_index = index
-                all_gates.append(final_and_gate)
-
-                # Create an OR gate with the "final" AND gate and partial_output
-                index += 1
-                partial_output = {"id": index, "type": "OR", "in": [final_and_gate_index, partial_output.get("id")]}
-                all_gates.append(partial_output)
-                index += 1
-
-                # Use multiplexer_circuit to finalize outputs
-                final_outputs = self.multiplexer_circuit(first_number, second_number, index, partial_output, all_gates)
-
-            return all_gates, final_outputs
-        else:
-            # Recursive case: it's not the last bit position: process the current bits and recurse
-            not_index = index
-            a0 = first_number[input_slider]  # Current bit from first_number
-            b0 = second_number[input_slider]  # Current bit from second_number
-            input_slider += 1
+    def get_max_circuit(self, shape):
+        """
+        Method to get the max circuit of the given shape and of the comparator of this Alice from circuit_cache,
+        built only if it is not cached
+        Args:
+            shape: the tuple (topology, input_length, bit_length) of the circuit
 
-            # Create a NOT gate for the current bit of second_number
-            all_gates.append({"id": not_index, "type": "NOT", "in": [b0]})
-            index += 1
+        Returns:
+            the dictionary of the max circuit, shared with the cache, it must not be modified
+        """
+        return self.circuit_cache.get(("max_circuit",) + shape + (self.comparator,),
+                                      lambda: self.build_max_circuit(*shape))
 
-            # Create an AND gate with the current bit of first_number and the NOT gate output
-            and_gate = {"id": index, "type": "AND", "in": [a0, not_index]}
-            all_gates.append(and_gate)
-            index += 1
+    def build_max_circuit(self, topology, input_set_length, bit_rep_length):
+        """
+        Method to build the max circuit with max_circuit and store it in a JSON file inside circuits folder, named
+        total_circuit.json, the JSON file is written without building its string
 
-            # Create an XNOR gate for the current bits of first_number and second_number
-            xnor_gate = {"id": index, "type": "XNOR", "in": [a0, b0]}
-            all_gates.append(xnor_gate)
-            index += 1
+        Args:
+            topology: how the comparators are connected, see create_max_cicruit
+            input_set_length: the agreed number of inputs
+            bit_rep_length: the agreed bit representation length for each input
 
-            if carry_compared_gate is None:
-                # Initialize partial_output and carry_compared_gate for the first comparison
-                partial_output = and_gate
-                carry_compared_gate = xnor_gate
-            else:
-                # Create a partial AND gate with the current AND gate and carry_compared_gate
-                partial_and_gate = {"id": index, "type": "AND",
-                                    "in": [and_gate.get("id"), carry_compared_gate.get("id")]}
-                partial_and_gate_index = index
-                all_gates.append(partial_and_gate)
+        Returns:
+            the dictionary of the max circuit, with its id, the wires of alice and bob, the outputs and the gates
+        """
+        circuit = self.max_circuit(topology, input_set_length, bit_rep_length)
 
-                # Create an OR gate with the partial AND gate and partial_output
-                index += 1
-                partial_output = {"id": index, "type": "OR", "in": [partial_and_gate_index, partial_output.get("id")]}
-                all_gates.append(partial_output)
+        # Write the JSON file, chunk by chunk
+        dump_json('circuits/total_circuit.json', {"name": "max_circuit", "circuits": [circuit]})
 
-                # Create a progressive carry AND gate with the current XNOR gate and carry_compared_gate
-                index += 1
-                carry_compared_gate = {"id": index, "type": "AND",
-                                       "in": [xnor_gate.get("id"), carry_compared_gate.get("id")]}
-                all_gates.append(carry_compared_gate)
-                index += 1
+        return circuit
 
-            # Recursive call to process the next bits
-            return self.greater_circuit(
-                first_number,
-                second_number,
-                input_slider,
-                all_gates,
-                index,
-                partial_output,
-                carry_compared_gate
-            )
-
-    def multiplexer_circuit(self, first_number, second_number, index, partial_output, all_gates):
-        """
-        The multiplexer_circuit is called to finalize the outputs of the greater_circuit by multiplexing
-        the comparison result into the final output gates. It creates a n-bit multiplexer circuit, that, based
-        on the final OR gate result of the greater circuit, chooses the correct greater number
-        Args:
-            first_number: the first number that can be chosen
-            second_number: the second number that can be chosen
-            index: progressive index, for the gate IDs, gets update every time a new gate is created
-            partial_output: the OR gate before adding the multiplexer to choose the correct number
-            all_gates: list of all the gates of the circuit
 
-        Returns:
-            a list containing the final n indexes of OR gates that represent the chosen greater number
-        """
+def collect_gates(gates):
+    """
+    Consume a generator of gates, such as Alice.max_gates
+    Args:
+        gates: the generator
 
-        # List to hold AND gates created for first_number
-        first_ands = []
-        for gate in first_number:
-            # Create an AND gate with the partial output and each gate from first_number
-            first_ands.append({"id": index, "type": "AND", "in": [partial_output.get("id"), gate]})
-            index += 1
-        all_gates.extend(first_ands)
-
-        # Create a NOT gate for the partial output
-        not_partial_output_gate = {"id": index, "type": "NOT", "in": [partial_output.get("id")]}
-        # List to hold AND gates created for second_number
-        second_ands = []
-        all_gates.append(not_partial_output_gate)
-        index += 1
-        for gate in second_number:
-            # Create an AND gate with the NOT gate of partial output and each gate from second_number
-            second_ands.append({"id": index, "type": "AND", "in": [not_partial_output_gate.get("id"), gate]})
-            index += 1
-        all_gates.extend(second_ands)
-
-        # List to hold the final output gates
-        final_outputs = []
-        for first_ands, second_ands in zip(first_ands, second_ands):
-            all_gates.append({"id": index, "type": "OR", "in": [first_ands.get("id"), second_ands.get("id")]})
-            final_outputs.append(index)
-            index += 1
-
-        return final_outputs
+    Returns:
+        the list of the gates and the list of output indexes returned by the generator
+    """
+    gates_list = []
+    while True:
+        try:
+            gates_list.append(next(gates))
+        except StopIteration as stop:
+            return gates_list, stop.value
@@ -0,0 +1,205 @@
+# DO NOT MOVE THIS SCRIPT, IT MUST BE INSIDE THE FOLDER ./src
+import argparse
+import random
+import time
+
+from alice import MaxCircuitBuilder
+from util.util import BITWISE_COMPARATOR, CARRY_COMPARATOR, CLASSIC, FIXED_KEY, FREE_XOR, GRR3, HALF_GATES
+from util.util import LINEAR_TOPOLOGY, PACKED_SCHEMES, PADDING_GEOMETRIC
+from util.util import PADDING_POWER_OF_TWO, PADDING_RANDOM, PADDING_SLACK, pad_length
+from yao import yao
+from yao.circuitOptimizer import optimize_circuit
+from yao.circuitProgram import CircuitProgram
+from yao.garbledCircuit import GarbledCircuit
+from yao.primeGroup import MODP_GROUPS, get_group
+
+
+def build_max_circuit(input_length, bit_length, comparator=BITWISE_COMPARATOR):
+    """
+    Build the max circuit that alice would create for the given agreed lengths, without any communication, garbling
+    or file
+    Args:
+        input_length: the number of inputs of each party
+        bit_length: the number of bits of each input
+        comparator: Optional; the comparators of the circuit, see Alice
+
+    Returns:
+        the circuit dictionary, as created by Alice.create_max_cicruit
+    """
+    return MaxCircuitBuilder(comparator).max_circuit(LINEAR_TOPOLOGY, input_length, bit_length)
+
+
+def benchmark_garbling(input_length, bit_length, repeat, comparator):
+    """
+    Print the gates garbled per second by each fixed-key AES scheme, gate by gate and in batches
+    Args:
+        input_length: the number of inputs of each party
+        bit_length: the number of bits of each input
+        repeat: how many times each circuit is garbled, the best time is kept
+        comparator: the comparators of the circuit, see Alice
+    """
+    circuit = build_max_circuit(input_length, bit_length, comparator)
+    n_gates = len(circuit["gates"])
+    print(f"max circuit with input_length {input_length} and bit_length {bit_length}: {n_gates} gates")
+
+    for scheme in (HALF_GATES, FIXED_KEY, GRR3):
+        for batch in (False, True):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                GarbledCircuit(circuit, scheme=scheme, batch=batch)
+                best = min(best, time.perf_counter() - start)
+            print(f"{scheme:>10} batch={str(batch):<5} {best:8.3f}s {n_gates / best:10.0f} gates/s")
+
+
+def benchmark_evaluation(input_length, bit_length, repeat, comparator):
+    """
+    Print the time per gate of the evaluation of each scheme, with the circuit compiled by evaluate and precompiled
+    Args:
+        input_length: the number of inputs of each party
+        bit_length: the number of bits of each input
+        repeat: how many times each circuit is evaluated, the best time is kept
+        comparator: the comparators of the circuit, see Alice
+    """
+    circuit = build_max_circuit(input_length, bit_length, comparator)
+    n_gates = len(circuit["gates"])
+    print(f"max circuit with input_length {input_length} and bit_length {bit_length}: {n_gates} gates")
+
+    start = time.perf_counter()
+    program = CircuitProgram(circuit)
+    print(f"compiled in {time.perf_counter() - start:.3f}s")
+
+    for scheme in (CLASSIC, FREE_XOR, HALF_GATES, FIXED_KEY, GRR3):
+        garbled_circuit = GarbledCircuit(circuit, scheme=scheme)
+        keys, pbits = garbled_circuit.get_keys(), garbled_circuit.get_pbits()
+        g_tables = garbled_circuit.get_garbled_tables()
+        if scheme in PACKED_SCHEMES:
+            g_tables = garbled_circuit.get_packed_tables()
+        bits = {wire: random.randint(0, 1) for wire in circuit["alice"] + circuit["bob"]}
+        inputs = {wire: (keys[wire][bit], pbits[wire] ^ bit) for wire, bit in bits.items()}
+        pbits_out = {wire: pbits[wire] for wire in circuit["out"]}
+
+        for label, compiled in (("circuit", circuit), ("program", program)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                yao.evaluate(compiled, g_tables, pbits_out, inputs, {}, scheme)
+                best = min(best, time.perf_counter() - start)
+            print(f"{scheme:>10} {label:<8} {best:8.3f}s {1e6 * best / n_gates:8.2f} us/gate")
+
+
+def benchmark_optimization(input_length, bit_length, repeat, comparator):
+    """
+    Print the gates removed from the max circuit by optimize_circuit, and the time saved by each scheme on the
+    garbling and the evaluation of the optimized circuit
+    Args:
+        input_length: the number of inputs of each party
+        bit_length: the number of bits of each input
+        repeat: how many times each circuit is garbled and evaluated, the best time is kept
+        comparator: the comparators of the circuit, see Alice
+    """
+    circuit = build_max_circuit(input_length, bit_length, comparator)
+    optimized, report = optimize_circuit(circuit)
+    print(f"max circuit with input_length {input_length} and bit_length {bit_length}: "
+          f"{report['gates_before']} -> {report['gates_after']} gates, "
+          f"{report['non_free_gates_before']} -> {report['non_free_gates_after']} not free with free-XOR, "
+          f"optimized in {report['seconds']:.3f}s")
+
+    bits = {wire: random.randint(0, 1) for wire in circuit["alice"] + circuit["bob"]}
+    for scheme in (CLASSIC, FREE_XOR, HALF_GATES, FIXED_KEY, GRR3):
+        times = []
+        for compiled in (CircuitProgram(circuit), CircuitProgram(optimized)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                garbled_circuit = GarbledCircuit(compiled.circuit, scheme=scheme)
+                keys, pbits = garbled_circuit.get_keys(), garbled_circuit.get_pbits()
+                g_tables = garbled_circuit.get_garbled_tables()
+                if scheme in PACKED_SCHEMES:
+                    g_tables = garbled_circuit.get_packed_tables()
+                inputs = {wire: (keys[wire][bit], pbits[wire] ^ bit) for wire, bit in bits.items()}
+                pbits_out = {wire: pbits[wire] for wire in circuit["out"]}
+                yao.evaluate(compiled, g_tables, pbits_out, inputs, {}, scheme)
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+        print(f"{scheme:>10} garbling + evaluation {times[0]:8.3f}s -> {times[1]:8.3f}s "
+              f"({100 * (1 - times[1] / times[0]):5.1f}% saved)")
+
+
+def benchmark_padding(input_length, bit_length, slack, comparator):
+    """
+    Print, for each padding policy, the padded number of inputs of a party with input_length inputs, the lengths
+    sharing its bucket and the size of the max circuit and of the OTs it leads to. With PADDING_RANDOM the padded
+    length is random, its mean and its worst case are printed
+    Args:
+        input_length: the number of inputs of the party
+        bit_length: the number of bits of each input
+        slack: the slack of PADDING_GEOMETRIC
+        comparator: the comparators of the circuit, see Alice
+    """
+    # Both topologies have a comparator per input but one, so the circuit grows linearly with the padded length
+    comparator_gates = len(build_max_circuit(1, bit_length, comparator)["gates"])
+    print(f"{input_length} inputs of {bit_length} bits, {comparator_gates} gates per comparator")
+
+    for policy in (PADDING_POWER_OF_TWO, PADDING_GEOMETRIC):
+        padded = pad_length(input_length, policy, slack)
+        lowest = input_length
+        while lowest > 1 and pad_length(lowest - 1, policy, slack) == padded:
+            lowest -= 1
+        print(f"{policy:>12} {padded:10d} inputs ({padded / input_length:6.2f}x), "
+              f"{(2 * padded - 1) * comparator_gates:12d} gates, {padded * bit_length:10d} OTs, "
+              f"hides {lowest} to {padded} inputs")
+
+    for label, padded in (("mean", input_length * (input_length + 1) / 2), ("worst", input_length ** 2)):
+        print(f"{PADDING_RANDOM + ' ' + label:>12} {padded:10.0f} inputs ({padded / input_length:6.2f}x), "
+              f"{(2 * padded - 1) * comparator_gates:12.0f} gates, {padded * bit_length:10.0f} OTs")
+
+
+def benchmark_gen_pow(repeat):
+    """
+    Print the time of an exponentiation of the generator of each RFC 3526 group, with a plain pow and with the
+    fixed-base tables of PrimeGroup.gen_pow
+    Args:
+        repeat: how many exponentiations are timed for each group
+    """
+    for num_bits in MODP_GROUPS:
+        group = get_group(num_bits)
+        exponents = [group.rand_int() for _ in range(repeat)]
+
+        start = time.perf_counter()
+        group.gen_pow(1)  # builds the tables
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for exponent in exponents:
+            pow(group.generator, exponent, group.prime)
+        plain = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        group.gen_pow_many(exponents)
+        fixed_base = (time.perf_counter() - start) / repeat
+
+        print(f"{num_bits:>5} bits: pow {1e3 * plain:7.2f}ms, gen_pow {1e3 * fixed_base:7.2f}ms "
+              f"({plain / fixed_base:.1f}x), tables built in {build:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the garbled circuit implementation")
+    parser.add_argument("benchmark", choices=["garbling", "evaluation", "optimization", "padding", "gen_pow"])
+    parser.add_argument("--input-length", type=int, default=1000)
+    parser.add_argument("--bit-length", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--slack", type=float, default=PADDING_SLACK)
+    parser.add_argument("--comparator", choices=[BITWISE_COMPARATOR, CARRY_COMPARATOR], default=BITWISE_COMPARATOR)
+    args = parser.parse_args()
+
+    if args.benchmark == "garbling":
+        benchmark_garbling(args.input_length, args.bit_length, args.repeat, args.comparator)
+    elif args.benchmark == "evaluation":
+        benchmark_evaluation(args.input_length, args.bit_length, args.repeat, args.comparator)
+    elif args.benchmark == "optimization":
+        benchmark_optimization(args.input_length, args.bit_length, args.repeat, args.comparator)
+    elif args.benchmark == "padding":
+        benchmark_padding(args.input_length, args.bit_length, args.slack, args.comparator)
+    elif args.benchmark == "gen_pow":
+        benchmark_gen_pow(10 * args.repeat)
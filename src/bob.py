@@ -1,8 +1,12 @@
+import functools
 import logging
 
 from yao import evaluatorSocket
+from util.util import CLASSIC, EVALUATION_WORKERS, SERVER_PENDING, SERVER_SESSIONS, SERVER_TIMEOUT
 from util.util import copy_and_expand_list
 from yao import ot
+from yao import yao
+from yao.evaluatorServer import EvaluatorServer
 
 
 class Bob:
@@ -12,13 +16,27 @@ class Bob:
     them back.
 
     Args:
-        oblivious_transfer: Optional; enable the Oblivious Transfer protocol
-            (True by default).
+        oblivious_transfer: Optional; enable the Oblivious Transfer protocol,
+            with OT_EXTENSION a few base OTs are extended to all of Bob's
+            wires, Alice and Bob must use the same mode (True by default).
+        workers: Optional; the number of processes evaluating the circuit,
+            level by level, started once and reused by every evaluation of
+            this Bob (EVALUATION_WORKERS by default).
+        pipelined: Optional; talk to Alice over a pipelined socket, where no
+            message waits for an acknowledgement, Alice and Bob must use the
+            same transport (False by default).
+        socket: Optional; the socket to Alice, e.g. the SessionSocket of an
+            evaluator server, a new EvaluatorSocket if None (None by default).
+        pre_reduce: Optional; reduce the inputs to their max locally, see
+            Alice (False by default).
     """
 
-    def __init__(self, oblivious_transfer=True):
+    def __init__(self, oblivious_transfer=True, workers=EVALUATION_WORKERS, pipelined=False, socket=None,
+                 pre_reduce=False):
         self.inputs, self.max_bit_length, self.input_length = [], 0, 0
-        self.socket = evaluatorSocket.EvaluatorSocket()
+        self.workers = yao.EvaluationPool(workers) if workers > 1 else workers
+        self.pre_reduce = pre_reduce
+        self.socket = socket or evaluatorSocket.EvaluatorSocket(pipelined=pipelined)
 
         self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
 
@@ -36,10 +54,13 @@ class Bob:
         it useful to not reveal to each other any information about the inputs
         Args:
             input_length: the input length that bob will communicate to alice if it's greater than the alice's
-                          input_length received
+                          input_length received, 1 with pre_reduce as he only inputs his max
             max_bit_length: the maximum bit length to represent integers that bob will communicate to alice,
                             if it's greater than the alice's max_bit_length received
         """
+        if self.pre_reduce:
+            input_length = 1
+
         # Receive preliminary data from the socket from alice
         entry = self.socket.receive()
 
@@ -81,7 +102,8 @@ class Bob:
         logging.info("Start listening")
         try:
             for entry in self.socket.poll_socket():
-                self.socket.send(True)
+                if not self.socket.pipelined:
+                    self.socket.send(True)
                 b_wires, bits_b, result = self.send_evaluation(entry)
 
                 return result
@@ -96,10 +118,14 @@ class Bob:
         Args:
             entry: A dict representing the circuit to evaluate.
         """
+        if self.pre_reduce:
+            self.inputs = [max(self.inputs, default=0)]  # max(A + B) = max(max(A), max(B))
         self.inputs = copy_and_expand_list(self.inputs, self.input_length)
 
         circuit, pbits_out = entry["circuit"], entry["pbits_out"]
         garbled_tables = entry["garbled_tables"]
+        scheme = entry.get("scheme", CLASSIC)  # garbling scheme chosen by alice
+        stream = entry.get("stream", False)  # garbled tables streamed after the inputs
         a_wires = circuit.get("alice", [])  # list of Alice's wires
         b_wires = circuit.get("bob", [])  # list of Bob's wires
 
@@ -119,6 +145,50 @@ class Bob:
         }
 
         # Evaluate and send result to Alice
-        result = self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear)
+        result = self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear, scheme,
+                                     self.workers, stream)
 
         return b_wires, bits_b, result
+
+
+def evaluate_session(socket, inputs, input_length, max_bit_length, oblivious_transfer=True, pre_reduce=False):
+    """Run Bob's side of a whole computation over the socket of a session of an evaluator server.
+
+    Args:
+        socket: The SessionSocket of the session.
+        inputs: The list of Bob's inputs.
+        input_length: Bob's input length, see exchange_max_bit_length_and_number_of_inputs.
+        max_bit_length: Bob's bit length, see exchange_max_bit_length_and_number_of_inputs.
+        oblivious_transfer: Optional; the Oblivious Transfer mode of the garblers (True by default).
+        pre_reduce: Optional; reduce the inputs to their max locally, see Alice (False by default).
+
+    Returns:
+        the result of the computation
+    """
+    # A session already runs in a worker process of the server, the circuit is evaluated there
+    bob = Bob(oblivious_transfer, workers=1, socket=socket, pre_reduce=pre_reduce)
+    bob.read_inputs(inputs)
+    bob.exchange_max_bit_length_and_number_of_inputs(input_length, max_bit_length)
+    return bob.listen()
+
+
+def serve(inputs, input_length, max_bit_length, oblivious_transfer=True, max_sessions=SERVER_SESSIONS,
+          max_pending=SERVER_PENDING, pre_reduce=False, timeout=SERVER_TIMEOUT):
+    """Run Bob as an evaluator server, computing with the same inputs for every Alice until interrupted.
+
+    Each Alice connects with her own session_id, see EvaluatorServer.
+
+    Args:
+        inputs: The list of Bob's inputs.
+        input_length: Bob's input length.
+        max_bit_length: Bob's bit length.
+        oblivious_transfer: Optional; the Oblivious Transfer mode of the garblers (True by default).
+        max_sessions: Optional; the number of sessions evaluated at once (SERVER_SESSIONS by default).
+        max_pending: Optional; the number of sessions waiting for a worker (SERVER_PENDING by default).
+        pre_reduce: Optional; reduce the inputs to their max locally, see Alice (False by default).
+        timeout: Optional; the seconds a session may stay silent (SERVER_TIMEOUT by default).
+    """
+    session = functools.partial(evaluate_session, inputs=inputs, input_length=input_length,
+                                max_bit_length=max_bit_length, oblivious_transfer=oblivious_transfer,
+                                pre_reduce=pre_reduce)
+    EvaluatorServer(session, max_sessions=max_sessions, max_pending=max_pending, timeout=timeout).serve()
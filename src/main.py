@@ -1,11 +1,11 @@
 # DO NOT MOVE THIS SCRIPT, IT MUST BE INSIDE THE FOLDER ./src
 import json
-import random
 from multiprocessing import Process
 
 from alice import Alice
 from bob import Bob
-from util.util import read_input, write_to_file
+from util.util import pad_length, read_input, write_to_file
+from yao.packedTables import PackedTables
 
 
 def main(party):
@@ -21,16 +21,12 @@ def main(party):
                one for alice and the other for bob, in fact this same main gets called twice
     """
     alice_input = read_input('resources/Alice.txt')
-    alice_input_length = len(alice_input)
     alice_max_bit_length = len(bin(max(alice_input))[2:])
-    random_integer = random.randint(1, alice_input_length)
-    alice_input_length = alice_input_length * random_integer  # this adds randomness so that bob doesn't know alice's input cardinality
+    alice_input_length = pad_length(len(alice_input))  # so that bob only learns a bucket of alice's input cardinality
 
     bob_input = read_input('resources/Bob.txt')
-    bob_input_length = len(bob_input)
     bob_max_bit_length = len(bin(max(bob_input))[2:])
-    random_integer = random.randint(1, bob_input_length)
-    bob_input_length = bob_input_length * random_integer
+    bob_input_length = pad_length(len(bob_input))
 
     if party == 'alice':
         alice = Alice(oblivious_transfer=True)
@@ -73,8 +69,14 @@ def print_alice_to_bob(alice):
     parsed_gates = json.loads(str(circuit.get("gates")).replace("'", '"'))
     parsed_gates = f"The gates of the circuit are: \n {json.dumps(parsed_gates, indent=4)} \n"
 
+    tables = info.get("garbled_tables")
+    if isinstance(tables, (bytes, memoryview)):  # packed tables are printed row by row as well
+        tables = PackedTables(tables, circuit.get("gates"))
+    elif tables is None:  # streamed tables are garbled later, chunk by chunk
+        tables = {}
+
     garbled_tables = "garbled_tables = {\n"
-    for key, elements in info.get("garbled_tables").items():
+    for key, elements in tables.items():
         garbled_tables += f'    "{key}": \n'
         for e in elements.items():
             garbled_tables += f'    "{e}",\n'
@@ -0,0 +1,49 @@
+import multiprocessing
+import shutil
+import tempfile
+import unittest
+
+from alice import MaxCircuitBuilder
+from util.util import LINEAR_TOPOLOGY
+from yao.circuitCache import CircuitCache
+
+KEYS = [(LINEAR_TOPOLOGY, input_length, 4) for input_length in range(2, 8)]
+ROUNDS = 100
+PROCESSES = 6
+
+
+def use_cache(directory, results):
+    """Get every key from a cache on directory, keeping no circuit in memory, and put the error or None in results."""
+    cache = CircuitCache(directory, max_size=0, max_files=2)
+    builder = MaxCircuitBuilder()
+    try:
+        for _ in range(ROUNDS):
+            for key in KEYS:
+                circuit = cache.get(key, lambda: builder.max_circuit(*key))
+                assert len(circuit["alice"]) == key[1] * key[2]
+    except Exception as error:
+        results.put(repr(error))
+    else:
+        results.put(None)
+
+
+class CircuitCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_concurrent_eviction(self):
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=use_cache, args=(self.directory, results))
+                     for _ in range(PROCESSES)]
+        for process in processes:
+            process.start()
+        errors = [results.get(timeout=300) for _ in processes]
+        for process in processes:
+            process.join()
+
+        self.assertEqual(errors, [None] * PROCESSES)
+
+
+if __name__ == "__main__":
+    unittest.main()
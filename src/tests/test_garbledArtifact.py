@@ -0,0 +1,54 @@
+import multiprocessing
+import shutil
+import tempfile
+import unittest
+
+from alice import MaxCircuitBuilder
+from util.util import FIXED_KEY, LINEAR_TOPOLOGY
+from yao.garbledArtifact import ArtifactStore
+from yao.yaoGarbler import YaoGarbler
+
+SHAPE = (LINEAR_TOPOLOGY, 2, 4)
+ARTIFACTS = 120
+TAKERS = 6
+
+
+def take_all(directory, results):
+    """Take circuits from the store until it is empty, and put how many, or the error, in results."""
+    store, taken = ArtifactStore(directory), 0
+    try:
+        while store.take(SHAPE) is not None:
+            taken += 1
+    except Exception as error:
+        results.put(repr(error))
+    else:
+        results.put(taken)
+
+
+class ArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_concurrent_take(self):
+        store = ArtifactStore(self.directory)
+        circuit = MaxCircuitBuilder().max_circuit(*SHAPE)
+        garbler = YaoGarbler(None, FIXED_KEY)
+        for _ in range(ARTIFACTS):
+            store.put(SHAPE, garbler._garble(circuit))
+
+        results = multiprocessing.Queue()
+        takers = [multiprocessing.Process(target=take_all, args=(self.directory, results)) for _ in range(TAKERS)]
+        for taker in takers:
+            taker.start()
+        counts = [results.get(timeout=120) for _ in takers]
+        for taker in takers:
+            taker.join()
+
+        self.assertTrue(all(isinstance(count, int) for count in counts), counts)
+        self.assertEqual(sum(counts), ARTIFACTS)
+        self.assertEqual(store.count(SHAPE), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
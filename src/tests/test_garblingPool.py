@@ -0,0 +1,48 @@
+import threading
+import time
+import unittest
+
+from yao.garblingPool import GarblingPool
+
+SHAPE = ("linear", 2, 4)
+
+
+class GarblingPoolTest(unittest.TestCase):
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_failed_shape_keeps_ready_circuits(self):
+        calls, fail = [], threading.Event()
+
+        def produce(shape):
+            calls.append(shape)
+            if fail.is_set():
+                raise RuntimeError("garbling failed")
+            return {"shape": shape, "index": len(calls)}
+
+        pool = GarblingPool(produce, [SHAPE], capacity=3, learn_shapes=True)
+        self.addCleanup(pool.close)
+        self.wait_for(lambda: pool.metrics()["ready"][SHAPE] == 3)
+
+        fail.set()
+        self.assertIsNotNone(pool.take(SHAPE))  # the producer refills the shape, and fails
+        self.wait_for(lambda: pool.metrics()["failures"] == 1)
+
+        self.assertIsNotNone(pool.take(SHAPE))
+        self.assertIsNotNone(pool.take(SHAPE))
+        self.assertIsNone(pool.take(SHAPE))
+        self.assertIsNone(pool.take(SHAPE))  # a miss of a failed shape does not garble it again
+        time.sleep(0.2)
+
+        metrics = pool.metrics()
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(metrics["failed"], [SHAPE])
+        self.assertEqual((metrics["hits"], metrics["misses"], metrics["failures"]), (3, 2, 1))
+        self.assertEqual(metrics["by_shape"][SHAPE]["failures"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
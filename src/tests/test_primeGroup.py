@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from util.util import parse_json
+from yao.primeGroup import _load_group, get_group
+
+BITS = 64
+SAFE_PRIME = 0xbf368176d9887cb3  # of 64 bits, with (p - 1) / 2 prime
+GENERATOR = 2  # of the whole group of SAFE_PRIME
+SMALLER_SAFE_PRIME = 0x6bdbbdb3700ad5cb  # of 63 bits
+
+
+class PrimeGroupCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache_path = os.path.join(directory, "prime_groups.json")
+        _load_group.cache_clear()
+        self.addCleanup(_load_group.cache_clear)
+
+    def write_cache(self, text):
+        with open(self.cache_path, "w") as file:
+            file.write(text)
+
+    def assert_regenerated(self):
+        group = get_group(BITS, self.cache_path)
+        self.assertEqual(group.prime.bit_length(), BITS)
+        self.assertNotEqual(group.prime, SAFE_PRIME)
+        cached = parse_json(self.cache_path)[str(BITS)]
+        self.assertEqual((int(cached["prime"], 16), int(cached["generator"], 16)), (group.prime, group.generator))
+
+    def write_group(self, prime, generator):
+        self.write_cache(json.dumps({str(BITS): {"prime": format(prime, "x"), "generator": format(generator, "x")}}))
+
+    def test_valid_entry_is_used(self):
+        self.write_group(SAFE_PRIME, GENERATOR)
+        group = get_group(BITS, self.cache_path)
+        self.assertEqual((group.prime, group.generator), (SAFE_PRIME, GENERATOR))
+
+    def test_generated_entry_is_used(self):
+        generated = get_group(BITS, self.cache_path)
+        _load_group.cache_clear()
+        cached = get_group(BITS, self.cache_path)
+        self.assertEqual((cached.prime, cached.generator), (generated.prime, generated.generator))
+
+    def test_truncated_cache(self):
+        self.write_cache('{"64": {"prime": "bf36')
+        self.assert_regenerated()
+
+    def test_malformed_entry(self):
+        self.write_cache(json.dumps({str(BITS): {"prime": format(SAFE_PRIME, "x")}}))
+        self.assert_regenerated()
+
+    def test_invalid_groups(self):
+        entries = [
+            (SAFE_PRIME + 2, GENERATOR),  # not prime
+            (SMALLER_SAFE_PRIME, GENERATOR),  # of another size
+            (SAFE_PRIME, SAFE_PRIME - 1),  # generator of order 2
+            (SAFE_PRIME, 4),  # a square, generator of the subgroup of order (p - 1) / 2
+            (SAFE_PRIME, SAFE_PRIME + 5),  # out of range
+        ]
+        for prime, generator in entries:
+            with self.subTest(prime=prime, generator=generator):
+                _load_group.cache_clear()
+                self.write_group(prime, generator)
+                self.assert_regenerated()
+
+
+if __name__ == "__main__":
+    unittest.main()
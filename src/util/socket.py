@@ -1,21 +1,94 @@
+import collections
+import pickle
+import struct
+
 import zmq
 
+from util.util import PIPELINE_HWM, ZERO_COPY_MIN_BYTES
+
+# ID of the message, ID of the last message received by the sender when it was sent (0 if none)
+MESSAGE_IDS = struct.Struct(">QQ")
+
 
 class Socket:
+    """ZeroMQ socket sending Python objects as multipart messages.
+
+    The first frame of a message holds its ID and the ID of the message it
+    replies to. The second is a small header: the object pickled with
+    protocol 5, where every large bytes-like value is left out of band. Each
+    of those values follows as a raw frame, sent and received without copies,
+    so the receiver reads it in place as a memoryview.
+
+    With a PAIR or DEALER socket the transport is pipelined: either side
+    sends any number of messages without waiting, and send_wait picks its
+    reply by ID, keeping the other messages for the next receive. A message
+    of a single frame is a refusal of the peer, e.g. of an evaluator server
+    with no room for the session.
+    """
     def __init__(self, socket_type):
         self.socket = zmq.Context().socket(socket_type)
         self.poller = zmq.Poller()
         self.poller.register(self.socket, zmq.POLLIN)
+        self.pipelined = socket_type in (zmq.PAIR, zmq.DEALER)  # messages do not alternate direction
+        self.sent_id = 0  # ID of the last message sent
+        self.received_id = 0  # ID of the last message received, the next message sent replies to it
+        self.pending = collections.deque()  # (ID, message) received by send_wait before its reply
+        if self.pipelined:
+            self.socket.setsockopt(zmq.SNDHWM, PIPELINE_HWM)
+            self.socket.setsockopt(zmq.RCVHWM, PIPELINE_HWM)
 
     def send(self, msg):
-        self.socket.send_pyobj(msg)
+        self.sent_id += 1
+        frames = []  # raw frames of the out of band values, in the order of the header
+        header = pickle.dumps(self._out_of_band(msg), protocol=5,
+                              buffer_callback=lambda buffer: frames.append(buffer.raw()))
+        ids = MESSAGE_IDS.pack(self.sent_id, self.received_id)
+        self.socket.send_multipart([ids, header] + frames, copy=False)
+        return self.sent_id
 
     def receive(self):
-        return self.socket.recv_pyobj()
+        if self.pending:
+            self.received_id, msg = self.pending.popleft()
+            return msg
+        self.received_id, _, msg = self._receive_message()
+        return msg
 
     def send_wait(self, msg):
-        self.send(msg)
-        return self.receive()
+        msg_id = self.send(msg)
+        while True:
+            reply_id, reply_to, reply = self._receive_message()
+            if reply_to == msg_id:
+                self.received_id = reply_id
+                return reply
+            self.pending.append((reply_id, reply))
+
+    def _receive_message(self):
+        """Return the (ID, ID it replies to, message) of the next message of the socket."""
+        frames = self.socket.recv_multipart(copy=False)
+        if len(frames) == 1:
+            raise ConnectionRefusedError(frames[0].bytes.decode())
+        ids, header, *frames = frames
+        msg_id, reply_to = MESSAGE_IDS.unpack(ids.buffer)
+        return msg_id, reply_to, pickle.loads(header.buffer, buffers=[frame.buffer for frame in frames])
+
+    def close(self):
+        """Close the socket once its messages are sent, along with its context."""
+        self.socket.close()
+        self.socket.context.term()
+
+    @staticmethod
+    def _out_of_band(msg):
+        """Wrap the large bytes-like message, or values of a dict message, to pickle them out of band."""
+        def wrap(value):
+            # A memoryview cannot be pickled in band, e.g. the packed tables of a memory-mapped artifact
+            if isinstance(value, memoryview) or (isinstance(value, (bytes, bytearray))
+                                                 and len(value) >= ZERO_COPY_MIN_BYTES):
+                return pickle.PickleBuffer(value)
+            return value
+
+        if isinstance(msg, dict):
+            return {key: wrap(value) for key, value in msg.items()}
+        return wrap(msg)
 
     """
     From https://stackoverflow.com/questions/17174001/stop-pyzmq-receiver-by-keyboardinterrupt
@@ -24,8 +97,10 @@ class Socket:
     def poll_socket(self, timetick=100):
         try:
             while True:
+                while self.pending:
+                    yield self.receive()
                 obj = dict(self.poller.poll(timetick))
                 if self.socket in obj and obj[self.socket] == zmq.POLLIN:
-                    yield self.socket.recv_pyobj()
+                    yield self.receive()
         except KeyboardInterrupt:
             pass
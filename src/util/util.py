@@ -1,4 +1,5 @@
 import json
+import math
 import operator
 import os
 import random
@@ -10,9 +11,70 @@ import sympy
 LOCAL_PORT = 4080
 SERVER_HOST = "localhost"
 SERVER_PORT = 4080
+ZERO_COPY_MIN_BYTES = 64 * 1024  # bytes-like values at least this large are sent as raw frames, without copies
+PIPELINE_HWM = 8  # messages a pipelined socket queues before send blocks, bounds the streamed chunks in flight
+
+# OBLIVIOUS TRANSFER
+OT_EXTENSION = "extension"  # oblivious_transfer mode: a few base OTs are extended to all of Bob's wires
+OT_EXTENSION_BASE_OTS = 128  # base OTs of the extension, the bits of each row of its matrix
 
 # PRIME GROUP
-PRIME_BITS = 64  # order of magnitude of prime in base 2
+PRIME_BITS = 64  # order of magnitude of prime in base 2, 1536, 2048 and 3072 use the RFC 3526 groups
+PRIME_GROUP_CACHE = "outputs/prime_groups.json"  # groups generated for the other sizes, reused by later runs
+FIXED_BASE_WINDOW = 6  # bits of the exponent per table lookup in PrimeGroup.gen_pow
+FIXED_BASE_MIN_BITS = 512  # smaller groups use a plain pow, faster than the lookups
+
+# CIRCUIT CACHE
+CIRCUIT_CACHE_DIR = "outputs/circuit_cache"  # built circuits in compact form, reused by later runs
+CIRCUIT_CACHE_SIZE = 8  # circuits kept in memory, the least recently used is evicted first
+CIRCUIT_CACHE_FILES = 64  # circuits kept on disk, the least recently used is deleted first
+
+# GARBLING POOL
+GARBLING_POOL_CAPACITY = 2  # garbled circuits kept ready for each shape
+GARBLING_POOL_LOW_WATER = 0  # with REFILL_LOW_WATER, a shape is refilled once it has this many circuits left
+REFILL_EAGER = "eager"  # refill policy: garble a circuit as soon as a shape is below capacity
+REFILL_LOW_WATER = "low_water"  # refill policy: refill a shape to capacity in one go, once down to the low water mark
+
+# GARBLED ARTIFACTS
+GARBLED_ARTIFACT_DIR = "outputs/garbled_artifacts"  # garbled circuits stored by an ArtifactStore, each used once
+
+# INPUT PADDING
+PADDING_POWER_OF_TWO = "power_of_two"  # padding policy: pad to the next power of two, at most twice the inputs
+PADDING_GEOMETRIC = "geometric"  # padding policy: pad to the next bucket, each bucket PADDING_SLACK larger than the last
+PADDING_RANDOM = "random"  # padding policy: multiply by a random integer up to the inputs, up to their square
+PADDING_SLACK = 0.25  # with PADDING_GEOMETRIC, the inputs are padded by at most this fraction, rounded up
+
+# MAX CIRCUIT TOPOLOGIES
+LINEAR_TOPOLOGY = "linear"  # every input is compared with the running max
+TREE_TOPOLOGY = "tree"  # inputs are compared pairwise like a tournament, log depth
+
+# COMPARATORS
+BITWISE_COMPARATOR = "bitwise"  # greater and equal chains and an AND/OR multiplexer, 7 gates per bit not free-XOR
+CARRY_COMPARATOR = "carry"  # subtraction carry and an XOR multiplexer, 2 AND gates per bit, the rest free-XOR
+
+# EVALUATOR SERVER
+SERVER_SESSIONS = 4  # sessions evaluated at once, each by a worker process of the server
+SERVER_PENDING = 16  # sessions queued for a worker, the next ones are refused
+SERVER_TIMEOUT = 120  # seconds a running session may stay silent before its worker gives up on it
+
+# PARALLEL EVALUATION
+EVALUATION_WORKERS = 1  # processes evaluating a circuit, 1 evaluates it in the calling process
+PARALLEL_MIN_GATES = 10000  # smaller circuits are evaluated serially, a pool costs more than it saves
+PARALLEL_MIN_LEVEL_GATES = 256  # narrower levels are evaluated by the calling process, without the pool
+
+# GARBLING SCHEMES
+CLASSIC = "classic"  # independent keys per wire, every gate gets a double encrypted table
+FREE_XOR = "free_xor"  # keys share a global offset, XOR/XNOR/NOT gates need no table
+HALF_GATES = "half_gates"  # free-XOR, and AND/OR/NAND/NOR gates get a table of 2 ciphertexts
+FIXED_KEY = "fixed_key"  # independent keys, every row is a 16 bytes fixed-key AES hash XOR the output key
+GRR3 = "grr3"  # FIXED_KEY with garbled row reduction, the row at encrypted index (0, 0) is not sent
+FREE_XOR_SCHEMES = (FREE_XOR, HALF_GATES)  # schemes whose keys share a global offset
+HASHED_ROW_SCHEMES = (FIXED_KEY, GRR3)  # schemes whose rows are H(key_a, key_b, gate_id) XOR key_out
+PACKED_SCHEMES = (HALF_GATES, FIXED_KEY, GRR3)  # schemes with 16 bytes rows, sent as one packed buffer
+FREE_GATES = ("XOR", "XNOR", "NOT")  # gates garbled for free by the FREE_XOR_SCHEMES
+# (invert_a, invert_b, invert_out) such that gate(a, b) = ((a ^ invert_a) AND (b ^ invert_b)) ^ invert_out
+HALF_GATE_INVERSIONS = {"AND": (0, 0, 0), "OR": (1, 1, 1), "NAND": (0, 0, 1), "NOR": (1, 1, 0)}
+FIXED_AES_KEY = bytes.fromhex("5961 6f20 6669 7865 642d 6b65 7920 4145")  # public key of the fixed-key AES hash
 
 
 def next_prime(num):
@@ -130,23 +192,100 @@ def copy_and_expand_list(original_list, new_size):
     return new_list
 
 
+def pad_length(length, policy=PADDING_GEOMETRIC, slack=PADDING_SLACK):
+    """
+    Simple method to choose how many inputs a party with the given number of inputs pads them to, so that the other
+    party only learns a bucket of lengths. The buckets are the same for both parties, so the agreed length, the
+    greatest of the two, is a bucket as well
+    Args:
+        length: the number of inputs of the party
+        policy: Optional; PADDING_POWER_OF_TWO, PADDING_GEOMETRIC or PADDING_RANDOM, see their definition
+        slack: Optional; with PADDING_GEOMETRIC, the buckets grow by this fraction, so it bounds the padding
+
+    Returns:
+        the padded number of inputs
+    """
+    if policy == PADDING_POWER_OF_TWO:
+        return 1 << max(length - 1, 0).bit_length()
+    if policy == PADDING_GEOMETRIC:
+        padded = 1
+        while padded < length:
+            padded = max(padded + 1, math.ceil(padded * (1 + slack)))
+        return padded
+    if policy == PADDING_RANDOM:
+        return length * random.randint(1, length)
+    raise ValueError(f"Unknown padding policy {policy}")
+
+
 def gen_prime(num_bits):
     """Return random prime of bit size 'num_bits'"""
     r = secrets.randbits(num_bits)
     return next_prime(r)
 
 
+def gen_safe_prime(num_bits):
+    """Return random safe prime 2q + 1, with q prime, of bit size 'num_bits'"""
+    while True:
+        q = next_prime(secrets.randbits(num_bits - 2) | 1 << (num_bits - 2))  # top bit set, p has num_bits bits
+        if (2 * q + 1).bit_length() == num_bits and sympy.isprime(2 * q + 1):
+            return 2 * q + 1
+
+
 def xor_bytes(seq1, seq2):
     """XOR two byte sequence."""
+    if len(seq1) == len(seq2):  # XOR-ing the sequences as integers is much faster
+        num = int.from_bytes(seq1, byteorder="big") ^ int.from_bytes(seq2, byteorder="big")
+        return num.to_bytes(len(seq1), byteorder="big")
     return bytes(map(operator.xor, seq1, seq2))
 
 
+def set_lsb(seq, bit):
+    """Return a copy of the byte sequence with its least significant bit set to 'bit'."""
+    return seq[:-1] + bytes([(seq[-1] & 0xFE) | bit])
+
+
 def bits(num, width):
     """Convert number into a list of bits."""
     return [int(k) for k in f'{num:0{width}b}']
 
 
+def gate_levels(gates):
+    """
+    Group the gates of a circuit in topological levels: the inputs of a gate are either inputs of the circuit
+    or outputs of gates in the previous levels, so all the gates of a level can be processed together
+    Args:
+        gates: the list of gates of the circuit
+
+    Returns:
+        the list of levels, each one a list of gates sorted by ID
+    """
+    depths = {}
+    levels = []
+    for gate in sorted(gates, key=lambda g: g["id"]):
+        depth = max((depths.get(wire, -1) for wire in gate["in"]), default=-1) + 1
+        depths[gate["id"]] = depth
+        if depth == len(levels):
+            levels.append([])
+        levels[depth].append(gate)
+    return levels
+
+
 # HELPER FUNCTIONS
 def parse_json(json_path):
     with open(json_path) as json_file:
         return json.load(json_file)
+
+
+def dump_json(path, content):
+    """
+    Simple method to write content as indented JSON in a file at the given path, chunk by chunk, so the whole string
+    is never held in memory
+    Args:
+        path: the relative path to write the file to, relative to the src folder
+        content: the content to write to the file
+    """
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    final_path = os.path.normpath(os.path.join(base_path, path))
+    with open(final_path, 'w') as file:
+        json.dump(content, file, indent=4, separators=(', ', ': '))
+        file.write("\n")
@@ -0,0 +1,128 @@
+import collections
+import os
+import pickle
+import threading
+from array import array
+
+from util.util import CIRCUIT_CACHE_DIR, CIRCUIT_CACHE_FILES, CIRCUIT_CACHE_SIZE
+from yao.circuitProgram import NO_WIRE, OPCODES
+
+
+class CircuitCache:
+    """Cache of built circuits, in memory and on disk, keyed by the parameters they are built from.
+
+    In memory a circuit is kept as its dict, on disk in a compact form: a
+    pickle of the arrays of the gate IDs, opcodes and input wires, as in
+    CircuitProgram. Both levels evict the least recently used circuits, on
+    disk by modification time, which a hit refreshes. The dicts returned are
+    shared by every caller, they must not be modified. A cache can be shared
+    by threads, e.g. with the producer of a GarblingPool.
+
+    Args:
+        directory: Optional; the directory of the files, relative to the src
+            folder, or None to keep the circuits in memory only
+            (CIRCUIT_CACHE_DIR by default).
+        max_size: Optional; the number of circuits in memory
+            (CIRCUIT_CACHE_SIZE by default).
+        max_files: Optional; the number of circuits on disk
+            (CIRCUIT_CACHE_FILES by default).
+    """
+    def __init__(self, directory=CIRCUIT_CACHE_DIR, max_size=CIRCUIT_CACHE_SIZE, max_files=CIRCUIT_CACHE_FILES):
+        if directory is not None:
+            base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            directory = os.path.normpath(os.path.join(base_path, directory))
+        self.directory = directory
+        self.max_size = max_size
+        self.max_files = max_files
+        self.circuits = collections.OrderedDict()  # key -> circuit, from the least recently used
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """Return the circuit of a key, built with build() only if it is in no level of the cache.
+
+        Args:
+            key: A tuple of the parameters of the circuit, of strings and integers.
+            build: A function returning the circuit dict of the key.
+
+        Returns:
+            The circuit dict.
+        """
+        with self.lock:
+            if key in self.circuits:
+                self.circuits.move_to_end(key)
+                return self.circuits[key]
+
+            circuit = self._load(key)
+            if circuit is None:
+                circuit = build()
+                self._store(key, circuit)
+            self.circuits[key] = circuit
+            if len(self.circuits) > self.max_size:
+                self.circuits.popitem(last=False)
+            return circuit
+
+    def _path(self, key):
+        return os.path.join(self.directory, "-".join(str(part) for part in key) + ".pickle")
+
+    def _load(self, key):
+        """Return the circuit of a key stored on disk, or None."""
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                compact = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:  # evicted by another process since it was read, the circuit is still good
+            pass
+        return self.decode(compact)
+
+    def _store(self, key, circuit):
+        """Write the compact form of a circuit, then delete the least recently used files over max_files."""
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(self.encode(circuit), file, protocol=5)
+        os.replace(tmp_path, path)  # concurrent readers never see a partial file
+
+        dated = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                try:
+                    dated.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except FileNotFoundError:  # evicted by another process since it was listed
+                    continue
+        dated.sort()
+        for _, name in dated[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:  # evicted by another process too
+                pass
+
+    @staticmethod
+    def encode(circuit):
+        """Return the compact form of a circuit dict: the gates as arrays, the other fields as they are."""
+        gates = circuit["gates"]
+        compact = {key: value for key, value in circuit.items() if key != "gates"}
+        compact["gate_ids"] = array("q", (gate["id"] for gate in gates))
+        compact["gate_opcodes"] = array("B", (OPCODES.index(gate["type"]) for gate in gates))
+        compact["gate_in_a"] = array("q", (gate["in"][0] for gate in gates))
+        compact["gate_in_b"] = array("q", (gate["in"][1] if len(gate["in"]) > 1 else NO_WIRE for gate in gates))
+        return compact
+
+    @staticmethod
+    def decode(compact):
+        """Return the circuit dict of a compact form."""
+        circuit = {key: value for key, value in compact.items() if not key.startswith("gate_")}
+        circuit["gates"] = [
+            {"id": gate_id, "type": OPCODES[opcode], "in": [in_a] if in_b == NO_WIRE else [in_a, in_b]}
+            for gate_id, opcode, in_a, in_b in zip(compact["gate_ids"], compact["gate_opcodes"],
+                                                   compact["gate_in_a"], compact["gate_in_b"])
+        ]
+        return circuit
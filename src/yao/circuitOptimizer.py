@@ -0,0 +1,149 @@
+import time
+
+from util.util import FREE_GATES, HALF_GATE_INVERSIONS
+
+XOR_INVERSIONS = {"XOR": 0, "XNOR": 1}  # gate(a, b) = a ^ b ^ invert_out
+# Gate computing (a ^ invert) AND (b ^ invert) ^ invert_out, by (invert, invert_out)
+AND_GATES = {(0, 0): "AND", (0, 1): "NAND", (1, 0): "NOR", (1, 1): "OR"}
+COMPLEMENTS = {"AND": "NAND", "NAND": "AND", "OR": "NOR", "NOR": "OR", "XOR": "XNOR", "XNOR": "XOR"}
+
+
+def optimize_circuit(circuit):
+    """Return an equivalent circuit with fewer gates, to garble and evaluate in its place.
+
+    The gates are rewritten in topological order, and the value of each wire
+    is tracked as a literal (wire, negated, free_id): a wire of the optimized
+    circuit, or None for a constant, and whether it is negated (the value of
+    a constant). free_id is the ID of a removed gate, given to a NOT gate if
+    the literal has to be materialized. The passes are:
+        - NOT absorption: a NOT gate is only a negated literal. XOR and XNOR
+          absorb it by swapping type, AND, OR, NAND and NOR when both inputs
+          are negated, by swapping to their De Morgan dual, and NOT cancels
+          it out. A NOT gate is emitted only for a gate that cannot absorb
+          it. A gate whose first reader is a NOT is emitted complemented
+          (e.g. NOR for OR) as a negated literal, so that NOT is free too.
+        - Constant propagation: a gate with a constant input, or the same
+          wire twice, is a constant or a literal of its other input.
+        - Common subexpression elimination: a gate of the same type on the
+          same inputs as an earlier one is replaced by it.
+        - Dead gate removal: gates no output depends on are dropped.
+    The wires of the parties and of the outputs keep their IDs, and every
+    gate left keeps its ID, so the gates are still in topological order.
+
+    Args:
+        circuit: A dict containing circuit spec.
+
+    Returns:
+        A pair (optimized circuit, report). The report is a dict with the
+        number of gates, and of gates that are not free with the free-XOR
+        schemes, before and after, and the seconds taken.
+    """
+    start = time.perf_counter()
+    gates = sorted(circuit["gates"], key=lambda g: g["id"])
+    outputs = set(circuit["out"])
+    party_wires = circuit.get("alice", []) + circuit.get("bob", [])
+    literals = {}  # wire of the circuit -> its literal
+    emitted = {}  # ID -> gate of the optimized circuit
+    common = {}  # (type, sorted inputs) -> ID of the emitted gate
+
+    # Gates emitted complemented -> ID of their first reader, a NOT gate, free for the NOT of the complement
+    first_readers = {}
+    for gate in gates:
+        for wire in gate["in"]:
+            first_readers.setdefault(wire, gate)
+    complemented = {wire: reader["id"] for wire, reader in first_readers.items()
+                    if reader["type"] == "NOT" and reader["id"] not in outputs
+                    and wire not in outputs and wire not in party_wires}
+
+    def literal(wire):
+        return literals.get(wire, (wire, 0, wire))  # wires of the parties
+
+    def emit(gate_id, gate_type, inputs, reuse=True):
+        key = (gate_type, tuple(sorted(inputs)))
+        if reuse and key in common:
+            return common[key]
+        common.setdefault(key, gate_id)
+        emitted[gate_id] = {"id": gate_id, "type": gate_type, "in": list(inputs)}
+        return gate_id
+
+    def emit_literal(gate_id, gate_type, inputs):
+        """Emit a gate of the circuit, complemented if it is in complemented, and return its literal."""
+        if gate_id in complemented:
+            return emit(gate_id, COMPLEMENTS[gate_type], inputs), 1, complemented[gate_id]
+        wire = emit(gate_id, gate_type, inputs, reuse=gate_id not in outputs)  # an output keeps its ID
+        return wire, 0, wire
+
+    def materialize(input_literal):
+        wire, negated, free_id = input_literal
+        return emit(free_id, "NOT", [wire]) if negated else wire
+
+    for gate in gates:
+        gate_id, gate_type = gate["id"], gate["type"]
+        (wire_a, negated_a, _), *rest = inputs = [literal(wire) for wire in gate["in"]]
+
+        if gate_type == "NOT":
+            result = (wire_a, 1 - negated_a, gate_id)
+        elif gate_type in XOR_INVERSIONS:
+            wire_b, negated_b, _ = rest[0]
+            negated = negated_a ^ negated_b ^ XOR_INVERSIONS[gate_type]
+            if wire_a == wire_b:  # two constants, or the same wire
+                result = (None, negated, gate_id)
+            elif wire_a is None or wire_b is None:
+                result = (wire_b if wire_a is None else wire_a, negated, gate_id)
+            else:
+                result = emit_literal(gate_id, "XNOR" if negated else "XOR", [wire_a, wire_b])
+        else:
+            wire_b, negated_b, _ = rest[0]
+            invert_a, invert_b, invert_out = HALF_GATE_INVERSIONS[gate_type]
+            # The gate is (wire_a ^ bit_a) AND (wire_b ^ bit_b) ^ invert_out, a constant wire being 0
+            bit_a, bit_b = negated_a ^ invert_a, negated_b ^ invert_b
+            if wire_a is None:
+                result = (wire_b, bit_b ^ invert_out, gate_id) if bit_a else (None, invert_out, gate_id)
+            elif wire_b is None:
+                result = (wire_a, bit_a ^ invert_out, gate_id) if bit_b else (None, invert_out, gate_id)
+            elif wire_a == wire_b:
+                result = (wire_a, bit_a ^ invert_out, gate_id) if bit_a == bit_b else (None, invert_out, gate_id)
+            elif bit_a == bit_b:
+                result = emit_literal(gate_id, AND_GATES[bit_a, invert_out], [wire_a, wire_b])
+            else:  # only one input is negated, it cannot be absorbed
+                result = emit_literal(gate_id, gate_type, [materialize(inputs[0]), materialize(inputs[1])])
+
+        if gate_id in outputs and result[:2] != (gate_id, 0):
+            # Gate of this ID computing the literal, with free gates unless the gate of the circuit is not free
+            wire, negated, _ = result
+            # Any wire with a label XORed with itself is a constant, a wire of the parties or else an input of the
+            # first gate
+            source = party_wires[0] if party_wires else gates[0]["in"][0]
+            constants = [input_literal for input_literal in inputs if input_literal[0] is None]
+            if wire is None:
+                emitted[gate_id] = {"id": gate_id, "type": "XNOR" if negated else "XOR", "in": [source, source]}
+            elif negated:
+                emitted[gate_id] = {"id": gate_id, "type": "NOT", "in": [wire]}
+            elif constants:  # the wire XOR the constant input, built at the ID of the gate it comes from
+                _, bit, constant_id = constants[0]
+                constant = emit(constant_id, "XNOR" if bit else "XOR", [source, source])
+                emitted[gate_id] = {"id": gate_id, "type": "XNOR" if bit else "XOR", "in": [wire, constant]}
+            elif gate_type == "NOT":  # the NOT of a negated literal
+                emitted[gate_id] = {"id": gate_id, "type": "NOT", "in": [materialize(inputs[0])]}
+            else:  # a gate on the same wire twice, not free in the circuit either
+                emitted[gate_id] = {"id": gate_id, "type": "AND", "in": [wire, wire]}
+            result = (gate_id, 0, gate_id)
+        literals[gate_id] = result
+
+    # Dead gate removal, from the outputs
+    live, stack = set(), list(outputs)
+    while stack:
+        wire = stack.pop()
+        if wire in emitted and wire not in live:
+            live.add(wire)
+            stack.extend(emitted[wire]["in"])
+    optimized_gates = [emitted[gate_id] for gate_id in sorted(live)]
+
+    report = {
+        "gates_before": len(gates),
+        "gates_after": len(optimized_gates),
+        "non_free_gates_before": sum(gate["type"] not in FREE_GATES for gate in gates),
+        "non_free_gates_after": sum(gate["type"] not in FREE_GATES for gate in optimized_gates),
+        "seconds": time.perf_counter() - start,
+    }
+    return dict(circuit, gates=optimized_gates), report
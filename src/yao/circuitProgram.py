@@ -0,0 +1,49 @@
+from array import array
+
+from util.util import FREE_GATES, gate_levels
+
+OPCODES = ("AND", "OR", "NAND", "NOR", "XOR", "XNOR", "NOT")  # the opcode of a gate is its index here
+FREE_OPCODES = frozenset(OPCODES.index(gate_type) for gate_type in FREE_GATES)
+NOT_OPCODE = OPCODES.index("NOT")
+NO_WIRE = -1  # second input of the 1-input gates
+
+
+class CircuitProgram:
+    """Array-backed form of a circuit, compiled once for the garbler and the evaluator.
+
+    Gate i of the program has ID ids[i], opcode opcodes[i] and input wires
+    in_a[i] and in_b[i], and the gates are in a fixed topological order
+    (sorted by ID), so running the program needs no sort, no dict lookup on
+    the gate spec and no check that the inputs are ready.
+
+    Args:
+        circuit: A dict containing circuit spec.
+    """
+
+    def __init__(self, circuit):
+        self.circuit = circuit
+        self.gates = sorted(circuit["gates"], key=lambda g: g["id"])  # gate specs, in program order
+        self.ids = array("q", (gate["id"] for gate in self.gates))
+        self.opcodes = array("B", (OPCODES.index(gate["type"]) for gate in self.gates))
+        self.in_a = array("q", (gate["in"][0] for gate in self.gates))
+        self.in_b = array("q", (gate["in"][1] if len(gate["in"]) > 1 else NO_WIRE for gate in self.gates))
+        self.outputs = array("q", circuit["out"])
+
+        # Wires set by the parties, even those no gate reads (e.g. after optimize_circuit), as they get labels
+        gate_wires = set(self.ids)
+        self.inputs = sorted({wire for wires in (self.in_a, self.in_b) for wire in wires
+                              if wire != NO_WIRE and wire not in gate_wires}
+                             | set(circuit.get("alice", [])) | set(circuit.get("bob", [])))
+        self.wires = self.inputs + list(self.ids)
+        self.n_wires = max(self.wires, default=NO_WIRE) + 1  # size of an array indexed by wire ID
+
+        # Positions of the gates of each topological level
+        position = {gate_id: i for i, gate_id in enumerate(self.ids)}
+        self.levels = [array("q", (position[gate["id"]] for gate in level)) for level in gate_levels(self.gates)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """Yield the (gate ID, opcode, input a, input b) of each gate, in program order."""
+        return zip(self.ids, self.opcodes, self.in_a, self.in_b)
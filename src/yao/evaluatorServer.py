@@ -0,0 +1,189 @@
+import logging
+import multiprocessing
+import time
+
+import zmq
+
+from util.socket import Socket
+from util.util import LOCAL_PORT, SERVER_PENDING, SERVER_SESSIONS, SERVER_TIMEOUT
+
+# Control messages, of a single frame: a worker is connected, a worker is done, a session is refused
+SESSION_READY = b"ready"
+SESSION_DONE = b"done"
+SESSION_REFUSED = b"the evaluator server has no room for the session"
+
+
+class SessionSocket(Socket):
+    """Socket of a worker of the evaluator server, carrying the messages of one session.
+
+    A receive waiting longer than timeout raises a TimeoutError, so the
+    worker of a garbler that crashed or left is freed.
+
+    Args:
+        session_id: The ID of the session, as bytes.
+        endpoint: The endpoint of the workers of the server.
+        timeout: Optional; the seconds a receive waits for the garbler
+            (SERVER_TIMEOUT by default).
+    """
+    def __init__(self, session_id, endpoint, timeout=SERVER_TIMEOUT):
+        super().__init__(zmq.DEALER)
+        self.session_id = session_id
+        self.timeout = timeout
+        self.socket.setsockopt(zmq.IDENTITY, session_id)
+        self.socket.setsockopt(zmq.RCVTIMEO, int(1000 * timeout))
+        self.socket.connect(endpoint)
+        self.socket.send(SESSION_READY)
+
+    def _receive_message(self):
+        try:
+            return super()._receive_message()
+        except zmq.Again:
+            raise TimeoutError(f"Session {self.session_id} idle for {self.timeout}s") from None
+
+    def poll_socket(self, timetick=100):
+        """Yield the messages of the session, the receives time out instead of polling forever."""
+        while True:
+            yield self.receive()
+
+    def close(self):
+        self.socket.send(SESSION_DONE)
+        super().close()
+
+
+def run_session(session, session_id, endpoint, timeout=SERVER_TIMEOUT):
+    """Run a session in a worker of the server.
+
+    Args:
+        session: A function running the evaluator's side of the protocol on
+            the SessionSocket it is given, and returning its result.
+        session_id: The ID of the session, as bytes.
+        endpoint: The endpoint of the workers of the server.
+        timeout: Optional; the seconds the session may stay silent
+            (SERVER_TIMEOUT by default).
+
+    Returns:
+        The result of the session.
+    """
+    socket = SessionSocket(session_id, endpoint, timeout)
+    try:
+        return session(socket)
+    finally:
+        socket.close()
+
+
+class EvaluatorServer:
+    """Long-running evaluator, serving many garblers at once.
+
+    Every garbler connects with a GarblerSocket of its own session ID. The
+    first message of a new session queues it for a pool of max_sessions
+    worker processes, each one running a session at a time over a
+    SessionSocket, with its own state and OT. The server routes the messages
+    of each session between the garbler and its worker, keeping those
+    that arrive before the worker is ready. Once max_sessions sessions run
+    and max_pending wait for a worker, the new sessions are refused.
+
+    A worker gives up on a session silent for timeout seconds. The server
+    forgets a running session silent for twice as long, in case its worker
+    died, and drops for timeout seconds the late messages of a session that
+    is over, so they do not start it again.
+
+    Args:
+        session: A function running the evaluator's side of the protocol on
+            the SessionSocket it is given, it must be picklable.
+        endpoint: Optional; the endpoint the garblers connect to
+            (tcp://*:LOCAL_PORT by default).
+        max_sessions: Optional; the number of worker processes
+            (SERVER_SESSIONS by default).
+        max_pending: Optional; the number of sessions waiting for a worker
+            (SERVER_PENDING by default).
+        timeout: Optional; the seconds a running session may stay silent
+            (SERVER_TIMEOUT by default).
+    """
+    def __init__(self, session, endpoint=f"tcp://*:{LOCAL_PORT}", max_sessions=SERVER_SESSIONS,
+                 max_pending=SERVER_PENDING, timeout=SERVER_TIMEOUT):
+        self.session = session
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.sessions = {}  # session ID -> messages waiting for its worker, None once the worker is ready
+        self.last_seen = {}  # running session ID -> time of its last message
+        self.finished = {}  # session ID -> time it ended, its late messages are dropped
+
+        context = zmq.Context()
+        self.frontend = context.socket(zmq.ROUTER)  # garblers
+        self.frontend.bind(endpoint)
+        self.backend = context.socket(zmq.ROUTER)  # workers
+        self.backend_endpoint = f"tcp://127.0.0.1:{self.backend.bind_to_random_port('tcp://127.0.0.1')}"
+        self.poller = zmq.Poller()
+        self.poller.register(self.frontend, zmq.POLLIN)
+        self.poller.register(self.backend, zmq.POLLIN)
+
+    def serve(self, timetick=100):
+        """Serve the sessions until interrupted."""
+        logging.info("Start serving")
+        with multiprocessing.Pool(self.max_sessions) as pool:
+            try:
+                while True:
+                    events = dict(self.poller.poll(timetick))
+                    if self.frontend in events:
+                        self._from_garbler(pool, self.frontend.recv_multipart(copy=False))
+                    if self.backend in events:
+                        self._from_worker(self.backend.recv_multipart(copy=False))
+                    self._expire(time.monotonic())
+            except KeyboardInterrupt:
+                logging.info("Stop serving")
+
+    def _from_garbler(self, pool, frames):
+        """Route a message of a garbler to the worker of its session, starting the session if it is new."""
+        session_id, message = frames[0].bytes, frames[1:]
+        if session_id in self.finished:
+            logging.info(f"Message of the finished session {session_id} dropped")
+            return
+        if session_id not in self.sessions:
+            if len(self.sessions) >= self.max_sessions + self.max_pending:
+                logging.info(f"Session {session_id} refused")
+                self.frontend.send_multipart([session_id, SESSION_REFUSED])
+                return
+            logging.info(f"Session {session_id} queued")
+            self.sessions[session_id] = []
+            pool.apply_async(run_session, (self.session, session_id, self.backend_endpoint, self.timeout),
+                             error_callback=lambda error: logging.error(f"Session {session_id} failed: {error}"))
+
+        pending = self.sessions[session_id]
+        if pending is None:
+            self.last_seen[session_id] = time.monotonic()
+            self.backend.send_multipart([session_id] + message, copy=False)
+        else:
+            pending.append(message)
+
+    def _from_worker(self, frames):
+        """Route a message of a worker to the garbler of its session, or handle a control message."""
+        session_id, message = frames[0].bytes, frames[1:]
+        if session_id not in self.sessions:  # expired, its worker is late
+            return
+        self.last_seen[session_id] = time.monotonic()
+        if len(message) > 1:
+            self.frontend.send_multipart([session_id] + message, copy=False)
+        elif message[0].bytes == SESSION_READY:
+            for pending in self.sessions[session_id]:
+                self.backend.send_multipart([session_id] + pending, copy=False)
+            self.sessions[session_id] = None
+        else:
+            logging.info(f"Session {session_id} done")
+            self._finish(session_id)
+
+    def _finish(self, session_id):
+        """Forget a session, and drop its late messages for a while."""
+        del self.sessions[session_id]
+        self.last_seen.pop(session_id, None)
+        self.finished[session_id] = time.monotonic()
+
+    def _expire(self, now):
+        """Forget the running sessions silent for twice the timeout, and the sessions over for the timeout."""
+        for session_id, last_seen in list(self.last_seen.items()):
+            if now - last_seen > 2 * self.timeout:
+                logging.info(f"Session {session_id} expired")
+                self._finish(session_id)
+        for session_id, finished in list(self.finished.items()):
+            if now - finished > self.timeout:
+                del self.finished[session_id]
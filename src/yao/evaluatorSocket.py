@@ -5,6 +5,6 @@ from util.util import LOCAL_PORT
 
 
 class EvaluatorSocket(Socket):
-    def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}"):
-        super().__init__(zmq.REP)
+    def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}", pipelined=False):
+        super().__init__(zmq.PAIR if pipelined else zmq.REP)
         self.socket.bind(endpoint)
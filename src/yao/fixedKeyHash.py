@@ -0,0 +1,100 @@
+from Crypto.Cipher import AES
+
+from util.util import FIXED_AES_KEY
+
+GF_REDUCTION = (1 << 128) | 0x87  # x^128 + x^7 + x^2 + x + 1, used to double in GF(2^128)
+BLOCK_SIZE = 16
+
+
+def double(num):
+    """Multiply a 128 bit integer by 2 in GF(2^128)."""
+    num <<= 1
+    if num >> 128:
+        num ^= GF_REDUCTION
+    return num
+
+
+def double_blocks(num, n_blocks):
+    """Multiply by 2 in GF(2^128) each of the n_blocks 128 bit blocks packed in a big integer.
+
+    The top bit of every block is cleared before the shift, so nothing carries
+    into the next block, and the reduction is added back where it was set.
+    """
+    top_bits = int.from_bytes((b"\x80" + bytes(BLOCK_SIZE - 1)) * n_blocks, byteorder="big")
+    carries = (num & top_bits) >> 127  # 1 at the lowest bit of every block whose top bit was set
+    return ((num & ~top_bits) << 1) ^ (carries * 0x87)
+
+
+class FixedKeyHash:
+    """Tweakable hash built on AES with a fixed and public key.
+
+    H(key_a, key_b, tweak) = pi(K) ^ K with K = 2 * key_a ^ 4 * key_b ^ tweak,
+    where pi is AES under the fixed key and the products are in GF(2^128).
+    A single AES instance serves the whole circuit: there is no key schedule,
+    IV or padding per row, and every digest is a single 16 bytes block.
+
+    Args:
+        key: Optional; the fixed AES key, shared by garbler and evaluator.
+    """
+
+    def __init__(self, key=FIXED_AES_KEY):
+        self.cipher = AES.new(key, AES.MODE_ECB)
+
+    def hash(self, key_a, tweak, key_b=None):
+        """Hash one or two keys along with a tweak.
+
+        Args:
+            key_a: The first 16 bytes key.
+            tweak: An integer that makes the hash unique for each gate.
+            key_b: Optional; the second 16 bytes key, for 2-input gates.
+
+        Returns:
+            A 16 bytes digest.
+        """
+        block = double(int.from_bytes(key_a, byteorder="big")) ^ tweak
+        if key_b is not None:
+            block ^= double(double(int.from_bytes(key_b, byteorder="big")))
+        block_bytes = block.to_bytes(16, byteorder="big")
+        digest = int.from_bytes(self.cipher.encrypt(block_bytes), byteorder="big") ^ block
+        return digest.to_bytes(16, byteorder="big")
+
+    def hash_many(self, queries):
+        """Hash many (key_a, tweak, key_b) queries with a single AES call.
+
+        Args:
+            queries: A list of (key_a, tweak, key_b) tuples, key_b may be None.
+
+        Returns:
+            The list of 16 bytes digests, in the same order as the queries.
+        """
+        digests = self.hash_buffer(queries)
+        return [digests[i:i + BLOCK_SIZE] for i in range(0, len(digests), BLOCK_SIZE)]
+
+    def hash_buffer(self, queries):
+        """Hash many (key_a, tweak, key_b) queries into one buffer of concatenated digests.
+
+        All the blocks are concatenated, the doublings and the XORs are done
+        on the whole buffer as one big integer and the AES runs once in ECB
+        mode over the buffer, so the cost per row stays out of Python loops.
+
+        Args:
+            queries: A list of (key_a, tweak, key_b) tuples, key_b may be None.
+
+        Returns:
+            The 16 bytes digests of the queries, concatenated in the same order.
+        """
+        if not queries:
+            return b""
+        n_blocks = len(queries)
+        length = n_blocks * BLOCK_SIZE
+        zero_key = bytes(BLOCK_SIZE)
+        keys_a = int.from_bytes(b"".join(query[0] for query in queries), byteorder="big")
+        keys_b = int.from_bytes(
+            b"".join(zero_key if query[2] is None else query[2] for query in queries), byteorder="big")
+        tweaks = int.from_bytes(
+            b"".join(query[1].to_bytes(BLOCK_SIZE, byteorder="big") for query in queries), byteorder="big")
+
+        blocks = double_blocks(keys_a, n_blocks) ^ double_blocks(double_blocks(keys_b, n_blocks), n_blocks) ^ tweaks
+        blocks_bytes = blocks.to_bytes(length, byteorder="big")
+        digests = int.from_bytes(self.cipher.encrypt(blocks_bytes), byteorder="big") ^ blocks
+        return digests.to_bytes(length, byteorder="big")
@@ -0,0 +1,219 @@
+import json
+import mmap
+import os
+import secrets
+import struct
+from array import array
+
+from util.util import GARBLED_ARTIFACT_DIR, PACKED_SCHEMES
+from yao.circuitCache import CircuitCache
+
+# magic, version, scheme code, ID shared by the public and the secrets file, length of the JSON metadata
+HEADER = struct.Struct(">4sBB2x16sI")
+PUBLIC_MAGIC = b"YGCA"
+SECRETS_MAGIC = b"YGCS"
+VERSION = 1
+ALIGNMENT = 8  # every section starts at a multiple of this offset, so it can be cast in place
+SECRETS_SUFFIX = ".secrets"
+SECRETS_MODE = 0o600  # the secrets file is only readable by its owner
+
+
+def save_artifact(entry, path):
+    """Write a garbled circuit to disk as a pair of binary files.
+
+    The public file at path holds what the evaluator gets: the gate program,
+    as the arrays of gate IDs, opcodes and input wires of CircuitProgram,
+    the wires of the parties and of the outputs, and the packed garbled
+    tables. The secrets file at path + SECRETS_SUFFIX, only readable by its
+    owner, holds what only the garbler knows: the pair of keys and the p-bit
+    of each input wire, and the p-bits of the outputs. Each file is a header,
+    JSON metadata with the offset, type code and length of every section,
+    and the sections, aligned so that load_artifact maps them without
+    copies. Both files are written atomically, the secrets first.
+
+    Args:
+        entry: The entry of a circuit in the circuit list of a garbler,
+            garbled with a scheme of PACKED_SCHEMES and not streamed.
+        path: The path of the public file.
+    """
+    circuit, scheme = entry["circuit"], entry["scheme"]
+    if scheme not in PACKED_SCHEMES:
+        raise ValueError(f"The garbling scheme {scheme} has rows of variable size and cannot be stored as an artifact")
+    if entry["garbled_tables"] is None:
+        raise ValueError("The circuit is garbled chunk by chunk, it must be garbled whole to be stored")
+
+    garbled_tables = entry["garbled_tables"]
+    if entry["garbled_circuit"] is not None:  # not loaded from an artifact, so not packed yet
+        garbled_tables = entry["garbled_circuit"].get_packed_tables()
+    artifact_id = secrets.token_bytes(16)
+    scheme_code = PACKED_SCHEMES.index(scheme)
+
+    compact = CircuitCache.encode(circuit)
+    public = {key: value for key, value in compact.items() if key.startswith("gate_")}
+    for key in ("alice", "bob", "out"):
+        public[key] = array("q", circuit.get(key, []))
+    public["garbled_tables"] = array("B")
+    public["garbled_tables"].frombytes(garbled_tables)
+    fields = {key: value for key, value in compact.items() if key not in public}
+
+    wires = circuit.get("alice", []) + circuit.get("bob", [])
+    keys, pbits = entry["keys"], entry["pbits"]
+    secret = {
+        "wires": array("q", wires),
+        "keys": array("B", b"".join(keys[wire][0] + keys[wire][1] for wire in wires)),
+        "pbits": array("B", (pbits[wire] for wire in wires)),
+        "pbits_out": array("B", (entry["pbits_out"][wire] for wire in circuit["out"])),
+    }
+
+    _write_sections(path + SECRETS_SUFFIX, SECRETS_MAGIC, scheme_code, artifact_id, secret, {}, SECRETS_MODE)
+    _write_sections(path, PUBLIC_MAGIC, scheme_code, artifact_id, public,
+                    {"circuit": fields, "optimization": entry.get("optimization")})
+
+
+def load_artifact(path, secrets_path=None):
+    """Load a garbled circuit written by save_artifact.
+
+    The public file is memory-mapped: the packed garbled tables of the entry
+    are a memoryview of the mapping, sent to the evaluator as a raw frame
+    without being copied or unpickled. The gate dicts of the circuit are
+    rebuilt from the mapped arrays, only the small secrets file is read.
+
+    Args:
+        path: The path of the public file.
+        secrets_path: Optional; the path of the secrets file
+            (path + SECRETS_SUFFIX by default).
+
+    Returns:
+        The entry of the circuit, to add to the circuit list of a garbler.
+    """
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    scheme_code, artifact_id, metadata, public = _read_sections(memoryview(mapping), PUBLIC_MAGIC)
+
+    with open(secrets_path or path + SECRETS_SUFFIX, "rb") as file:
+        if os.name == "posix" and os.fstat(file.fileno()).st_mode & 0o077:
+            raise PermissionError(f"The secrets of the artifact {path} are readable by other users")
+        secrets_code, secrets_id, _, secret = _read_sections(memoryview(file.read()), SECRETS_MAGIC)
+    if (secrets_code, secrets_id) != (scheme_code, artifact_id):
+        raise ValueError(f"The secrets of the artifact {path} belong to another circuit")
+
+    circuit = CircuitCache.decode(dict(metadata["circuit"], **{key: value for key, value in public.items()
+                                                               if key.startswith("gate_")}))
+    for key in ("alice", "bob", "out"):
+        circuit[key] = public[key].tolist()
+
+    wires, keys = secret["wires"], secret["keys"]
+    key_size = len(keys) // (2 * len(wires)) if wires else 0
+    pbits_out = secret["pbits_out"]
+    return {
+        "circuit": circuit,
+        "garbled_circuit": None,
+        "garbled_tables": public["garbled_tables"],
+        "keys": {wire: (bytes(keys[2 * i * key_size:(2 * i + 1) * key_size]),
+                        bytes(keys[(2 * i + 1) * key_size:(2 * i + 2) * key_size]))
+                 for i, wire in enumerate(wires)},
+        "pbits": dict(zip(wires, secret["pbits"])),
+        "pbits_out": {wire: pbits_out[i] for i, wire in enumerate(circuit["out"])},
+        "scheme": PACKED_SCHEMES[scheme_code],
+        "optimization": metadata["optimization"],
+    }
+
+
+def _write_sections(path, magic, scheme_code, artifact_id, sections, metadata, mode=0o644):
+    """Write a header, the metadata and the aligned sections, through a temporary file replacing path."""
+    offsets, offset = {}, 0
+    for name, values in sections.items():
+        offsets[name] = [offset, values.typecode, len(values)]
+        offset += -(-len(values) * values.itemsize // ALIGNMENT) * ALIGNMENT
+    encoded = json.dumps(dict(metadata, sections=offsets)).encode()
+    start = -(-(HEADER.size + len(encoded)) // ALIGNMENT) * ALIGNMENT  # offset of the first section
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    file = os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), "wb")
+    with file:
+        file.write(HEADER.pack(magic, VERSION, scheme_code, artifact_id, len(encoded)) + encoded)
+        for name, values in sections.items():
+            file.seek(start + offsets[name][0])
+            file.write(values)
+        file.truncate(start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_sections(buffer, magic):
+    """Return the scheme code, the ID, the metadata and the sections, cast in place, of a buffer."""
+    file_magic, version, scheme_code, artifact_id, length = HEADER.unpack_from(buffer)
+    if file_magic != magic or version != VERSION:
+        raise ValueError("The file is not a garbled circuit artifact")
+    metadata = json.loads(bytes(buffer[HEADER.size:HEADER.size + length]))
+    start = -(-(HEADER.size + length) // ALIGNMENT) * ALIGNMENT
+    sections = {}
+    for name, (offset, typecode, count) in metadata["sections"].items():
+        section = buffer[start + offset:start + offset + count * array(typecode).itemsize]
+        sections[name] = section.cast(typecode) if typecode != "B" else section
+    return scheme_code, artifact_id, metadata, sections
+
+
+class ArtifactStore:
+    """Directory of garbled circuits stored with save_artifact, each one used by a single session.
+
+    A store has the take of a GarblingPool, so it can be the pool of an
+    Alice: the circuits are garbled ahead of time, by another process or
+    another run, and put in the store under their shape. Taking a circuit
+    claims it by renaming its secrets file, so several processes can share
+    a store, and deletes its files once loaded (the mapping of the public
+    file stays valid).
+
+    Args:
+        directory: Optional; the directory of the files, relative to the src
+            folder (GARBLED_ARTIFACT_DIR by default).
+    """
+    def __init__(self, directory=GARBLED_ARTIFACT_DIR):
+        base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.directory = os.path.normpath(os.path.join(base_path, directory))
+
+    def _prefix(self, shape):
+        return "-".join(str(part) for part in shape) + "-"
+
+    def put(self, shape, entry):
+        """Store a garbled circuit of a shape, and return the path of its public file."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self._prefix(shape)}{secrets.token_hex(8)}.garbled")
+        save_artifact(entry, path)
+        return path
+
+    def count(self, shape):
+        """Return the number of circuits of a shape in the store."""
+        return len(self._paths(shape))
+
+    def take(self, shape):
+        """Return a garbled circuit of a shape, removed from the store, or None if there is none."""
+        for path in self._paths(shape):
+            claimed = f"{path}{SECRETS_SUFFIX}.{os.getpid()}.taken"
+            try:
+                os.rename(path + SECRETS_SUFFIX, claimed)  # fails if another process claimed it first
+            except FileNotFoundError:
+                continue
+            try:
+                return load_artifact(path, claimed)
+            finally:
+                os.remove(claimed)
+                os.remove(path)
+        return None
+
+    def _paths(self, shape):
+        """Return the public files of the complete circuits of a shape, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        prefix = self._prefix(shape)
+        dated = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not (name.startswith(prefix) and name.endswith(".garbled")):
+                continue
+            if not os.path.exists(path + SECRETS_SUFFIX):  # not complete yet, or taken
+                continue
+            try:
+                dated.append((os.path.getmtime(path), path))
+            except FileNotFoundError:  # taken by another process since it was listed
+                continue
+        return [path for _, path in sorted(dated)]
@@ -1,10 +1,38 @@
+import functools
+import itertools
 import pickle
 import random
 
 from Crypto.Random import get_random_bytes
 
+from util.util import CLASSIC, FIXED_KEY, FREE_GATES, FREE_XOR_SCHEMES, GRR3, HALF_GATES, HALF_GATE_INVERSIONS
+from util.util import HASHED_ROW_SCHEMES, PACKED_SCHEMES, gate_levels, set_lsb, xor_bytes
+from yao.circuitProgram import CircuitProgram
+from yao.fixedKeyHash import FixedKeyHash
+from yao.packedTables import pack_garbled_tables
 from yao.yao import encrypt
 
+# Logical function of each gate type
+GATE_OPERATORS = {
+    "OR": lambda b1, b2: b1 or b2,
+    "AND": lambda b1, b2: b1 and b2,
+    "XOR": lambda b1, b2: b1 ^ b2,
+    "NOR": lambda b1, b2: not (b1 or b2),
+    "NAND": lambda b1, b2: not (b1 and b2),
+    "XNOR": lambda b1, b2: not (b1 ^ b2),
+    "NOT": lambda b1: not b1
+}
+
+
+@functools.lru_cache(maxsize=None)
+def row_pattern(gate_type, pbits):
+    """Return the (encr_bits, bits, bit_out) of each row of a gate, given the p-bits of its inputs."""
+    operator, pattern = GATE_OPERATORS[gate_type], []
+    for encr_bits in itertools.product((0, 1), repeat=len(pbits)):
+        bits = tuple(encr_bit ^ pbit for encr_bit, pbit in zip(encr_bits, pbits))
+        pattern.append((encr_bits, bits, int(operator(*bits))))
+    return pattern
+
 
 class GarbledCircuit:
     """A representation of a garbled circuit.
@@ -12,51 +40,253 @@ class GarbledCircuit:
     Args:
         circuit: A dict containing circuit spec.
         pbits: Optional; a dict of p-bits for the given circuit.
+        scheme: Optional; the garbling scheme, CLASSIC, FREE_XOR, HALF_GATES,
+            FIXED_KEY or GRR3 (CLASSIC by default).
+        batch: Optional; with the fixed-key AES schemes, hash the rows of a
+            whole topological level (of the whole circuit for FIXED_KEY) with
+            one AES call (True by default).
+        garble: Optional; garble all the tables now, otherwise only the keys
+            of the inputs are ready and the tables are garbled chunk by chunk
+            with garble_chunks (True by default).
     """
 
-    def __init__(self, circuit, pbits={}):
+    def __init__(self, circuit, pbits={}, scheme=CLASSIC, batch=True, garble=True):
         self.circuit = circuit
-        self.gates = circuit["gates"]  # list of gates
-        self.wires = set()  # list of circuit wires
+        self.program = CircuitProgram(circuit)  # compiled once, gates in topological order
+        self.gates = self.program.gates  # list of gates
+        self.wires = self.program.wires  # list of circuit wires
+        self.scheme = scheme  # garbling scheme
+        self.batch = batch and scheme in PACKED_SCHEMES  # hash rows level by level
 
         self.pbits = {}  # dict of p-bits
         self.keys = {}  # dict of keys
         self.garbled_tables = {}  # dict of garbled tables
-
-        # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
+        self.delta = None  # global offset between the two keys of a wire (free-XOR only)
+        self.hasher = FixedKeyHash()  # a single AES instance for the whole circuit
 
         self._gen_pbits(pbits)
         self._gen_keys()
-        self._gen_garbled_tables()
+        if garble:
+            self._gen_garbled_tables(self.gates)
 
     def _gen_pbits(self, pbits):
         """Create a dict mapping each wire to a random p-bit."""
         if pbits:
-            self.pbits = pbits
+            self.pbits = dict(pbits)
         else:
             self.pbits = {wire: random.randint(0, 1) for wire in self.wires}
 
     def _gen_keys(self):
         """Create pair of keys for each wire."""
+        if self.scheme in FREE_XOR_SCHEMES:
+            self._gen_free_xor_keys()
+            return
+
+        derived_wires = {gate["id"] for gate in self.gates if self._is_derived(gate)}
         for wire in self.wires:
-            self.keys[wire] = (get_random_bytes(16), get_random_bytes(16))
+            if wire in derived_wires:
+                continue
+            if self.scheme in HASHED_ROW_SCHEMES:
+                # The last bit of a key is its encrypted bit, so a row only holds the output key
+                pbit = self.pbits[wire]
+                self.keys[wire] = (set_lsb(get_random_bytes(16), pbit), set_lsb(get_random_bytes(16), 1 - pbit))
+            else:
+                self.keys[wire] = (get_random_bytes(16), get_random_bytes(16))
 
-    def _gen_garbled_tables(self):
-        """Create the garbled table of each gate."""
-        for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.pbits)
+    def _gen_free_xor_keys(self):
+        """Create pair of keys for each wire, sharing a global offset.
+
+        The two keys of a wire always differ by the same offset delta, whose
+        last bit is set, so the last bit of a key is its encrypted bit.
+        The keys (and p-bits) of XOR, XNOR and NOT outputs, and of half gates
+        outputs, are derived while garbling, so they are skipped here.
+        """
+        self.delta = set_lsb(get_random_bytes(16), 1)
+        derived_wires = {gate["id"] for gate in self.gates if self._is_derived(gate)}
+
+        for wire in self.wires:
+            if wire not in derived_wires:
+                key0 = set_lsb(get_random_bytes(16), self.pbits[wire])
+                self.keys[wire] = (key0, xor_bytes(key0, self.delta))
+
+    def _is_derived(self, gate):
+        """Return True if the keys of the gate output are derived from its inputs."""
+        if self.scheme == GRR3:
+            return True
+        if self.scheme not in FREE_XOR_SCHEMES:
+            return False
+        return gate["type"] in FREE_GATES or self.scheme == HALF_GATES
+
+    def _set_output_keys(self, gate_id, keys):
+        """Store the derived pair of keys, and the p-bit, of a gate output."""
+        self.keys[gate_id] = keys
+        self.pbits[gate_id] = keys[0][-1] & 1
+
+    def _gen_free_gate_key(self, gate):
+        """Derive the keys of a XOR, XNOR or NOT output from the keys of its inputs."""
+        key0 = self.keys[gate["in"][0]][0]
+        if gate["type"] != "NOT":
+            key0 = xor_bytes(key0, self.keys[gate["in"][1]][0])
+        if gate["type"] != "XOR":  # XNOR and NOT flip the output bit
+            key0 = xor_bytes(key0, self.delta)
+        self._set_output_keys(gate["id"], (key0, xor_bytes(key0, self.delta)))
+
+    def _gen_garbled_tables(self, gates):
+        """Create the garbled table of each gate.
+
+        Gates are garbled in topological order because, with a global offset,
+        the keys of some outputs depend on the keys of the inputs.
+
+        Args:
+            gates: A list of gates in topological order, whose inputs are
+                circuit inputs or outputs of gates already garbled.
+        """
+        if self.batch:
+            self._gen_garbled_tables_batched(gates)
+            return
+
+        for gate in gates:
+            if self.scheme in FREE_XOR_SCHEMES and gate["type"] in FREE_GATES:
+                self._gen_free_gate_key(gate)  # free gates have no garbled table
+                continue
+            garbled_gate = GarbledGate(gate, self.keys, self.pbits, self.scheme, self.delta, self.hasher)
             self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+            if self._is_derived(gate):
+                self._set_output_keys(gate["id"], garbled_gate.get_output_keys())
+
+    def _gen_garbled_tables_batched(self, gates):
+        """Create the garbled table of each gate, hashing the rows of many gates at once.
+
+        The rows of a gate only depend on the keys of its inputs, so all the
+        gates of a topological level are hashed by a single AES call. With
+        FIXED_KEY no key is derived and all the gates are a single level.
+
+        Args:
+            gates: A list of gates in topological order, whose inputs are
+                circuit inputs or outputs of gates already garbled.
+        """
+        if self.scheme == FIXED_KEY:
+            levels = [gates]
+        else:
+            levels = gate_levels(gates)
+
+        for level in levels:
+            if self.scheme in HASHED_ROW_SCHEMES:
+                self._gen_hashed_level(level)
+                continue
+
+            garbled_gates = []
+            for gate in level:
+                if gate["type"] in FREE_GATES:
+                    self._gen_free_gate_key(gate)  # free gates have no garbled table
+                else:
+                    garbled_gates.append(gate)
+            self._gen_half_gates_level(garbled_gates)
+
+    def _gen_hashed_level(self, gates):
+        """Create the FIXED_KEY or GRR3 garbled tables of many gates at once.
+
+        The digests of all rows come from one AES call, and the rows are the
+        XOR of the digests buffer with the buffer of the matching output keys.
+
+        Args:
+            gates: A list of gates whose inputs already have their keys.
+        """
+        queries, rows = [], []  # rows holds (gate ID, encrypted bits, output bit) for every row
+        for gate in gates:
+            gate_id, wires = gate["id"], gate["in"]
+            in_keys = [self.keys[wire] for wire in wires]
+            for encr_bits, bits, bit_out in row_pattern(gate["type"], tuple(self.pbits[wire] for wire in wires)):
+                if len(bits) == 2:
+                    queries.append((in_keys[0][bits[0]], gate_id, in_keys[1][bits[1]]))
+                else:
+                    queries.append((in_keys[0][bits[0]], gate_id, None))
+                rows.append((gate_id, encr_bits, bit_out))
+        digests = self.hasher.hash_buffer(queries)
+
+        # The first row of each gate is at encrypted index (0, 0), with GRR3 it fixes the output keys
+        # (see GarbledGate._gen_hashed_table) and it is XOR-ed with zeros, then dropped
+        zero_key, out_keys = bytes(16), []
+        for position, (gate_id, encr_bits, bit_out) in enumerate(rows):
+            if self.scheme == GRR3 and not any(encr_bits):
+                digest = digests[16 * position:16 * (position + 1)]
+                other_key = set_lsb(get_random_bytes(16), 1 - (digest[-1] & 1))
+                self._set_output_keys(gate_id, (digest, other_key) if bit_out == 0 else (other_key, digest))
+                out_keys.append(zero_key)
+            else:
+                out_keys.append(self.keys[gate_id][bit_out])
+        table_rows = xor_bytes(digests, b"".join(out_keys))
+
+        for position, (gate_id, encr_bits, _) in enumerate(rows):
+            if not any(encr_bits):  # first row of the gate
+                self.garbled_tables[gate_id] = {}
+                if self.scheme == GRR3:
+                    continue
+            self.garbled_tables[gate_id][encr_bits] = table_rows[16 * position:16 * (position + 1)]
+
+    def _gen_half_gates_level(self, gates):
+        """Create the HALF_GATES garbled tables of many gates at once.
+
+        The digests of all gates come from one AES call, then each gate runs
+        the same steps as GarbledGate._gen_half_gates_table on integers.
+
+        Args:
+            gates: A list of AND, OR, NAND or NOR gates whose inputs already have their keys.
+        """
+        queries = [query for gate in gates
+                   for query in GarbledGate.hash_queries(gate, self.keys, self.pbits, HALF_GATES)]
+        digests = self.hasher.hash_buffer(queries)
+        delta = int.from_bytes(self.delta, byteorder="big")
+
+        for position, gate in enumerate(gates):
+            invert_a, invert_b, invert_out = HALF_GATE_INVERSIONS[gate["type"]]
+            gate_digests = [int.from_bytes(digests[start:start + 16], byteorder="big")
+                            for start in range(64 * position, 64 * (position + 1), 16)]
+            hash_a0, hash_a1 = gate_digests[invert_a], gate_digests[1 - invert_a]
+            hash_b0, hash_b1 = gate_digests[2 + invert_b], gate_digests[3 - invert_b]
+            key_a0 = int.from_bytes(self.keys[gate["in"][0]][invert_a], byteorder="big")
+            pbit_a, pbit_b = key_a0 & 1, self.keys[gate["in"][1]][invert_b][-1] & 1
+
+            table_g = hash_a0 ^ hash_a1 ^ (delta if pbit_b else 0)
+            key_g0 = hash_a0 ^ (table_g if pbit_a else 0)
+            table_e = hash_b0 ^ hash_b1 ^ key_a0
+            key_e0 = hash_b0 ^ (table_e ^ key_a0 if pbit_b else 0)
+            key_out = key_g0 ^ key_e0 ^ (delta if invert_out else 0)
+
+            self.garbled_tables[gate["id"]] = {0: table_g.to_bytes(16, byteorder="big"),
+                                               1: table_e.to_bytes(16, byteorder="big")}
+            self._set_output_keys(gate["id"], (key_out.to_bytes(16, byteorder="big"),
+                                               (key_out ^ delta).to_bytes(16, byteorder="big")))
+
+    def garble_chunks(self, chunk_size):
+        """Garble the circuit chunk by chunk, only the tables of the current chunk are kept.
+
+        Chunks are consecutive gates in topological order, so each one can be
+        sent and evaluated as soon as it is garbled. The p-bits of the derived
+        outputs are known once all the chunks are garbled.
+
+        Args:
+            chunk_size: The number of gates of each chunk.
+
+        Yields:
+            The list of gates of each chunk and the dict of their garbled tables.
+        """
+        for start in range(0, len(self.gates), chunk_size):
+            gates = self.gates[start:start + chunk_size]
+            self.garbled_tables = {}
+            self._gen_garbled_tables(gates)
+            yield gates, self.garbled_tables
+        self.garbled_tables = {}
 
     def print_garbled_tables(self):
         """Print p-bits and a clear representation of all garbled tables."""
         print(f"======== {self.circuit['id']} ========")
         print(f"P-BITS: {self.pbits}")
         for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.pbits)
+            if self.scheme in FREE_XOR_SCHEMES and gate["type"] in FREE_GATES:
+                print(f"GATE: {gate['id']}, TYPE: {gate['type']} (free)")
+                continue
+            garbled_table = GarbledGate(gate, self.keys, self.pbits, self.scheme, self.delta, self.hasher)
             garbled_table.print_garbled_table()
         print()
 
@@ -68,10 +298,18 @@ class GarbledCircuit:
         """Return dict mapping each gate to its garbled table."""
         return self.garbled_tables
 
+    def get_packed_tables(self):
+        """Return all garbled tables packed into one contiguous buffer (only for PACKED_SCHEMES)."""
+        return pack_garbled_tables(self.gates, self.garbled_tables, self.scheme)
+
     def get_keys(self):
         """Return dict mapping each wire to its pair of keys."""
         return self.keys
 
+    def get_scheme(self):
+        """Return the garbling scheme of the circuit."""
+        return self.scheme
+
 class GarbledGate:
     """A representation of a garbled gate.
 
@@ -79,11 +317,22 @@ class GarbledGate:
         gate: A dict containing gate spec.
         keys: A dict mapping each wire to a pair of keys.
         pbits: A dict mapping each wire to its p-bit.
+        scheme: Optional; the garbling scheme (CLASSIC by default).
+        delta: Optional; the global offset between the two keys of a wire,
+            required by HALF_GATES.
+        hasher: Optional; the FixedKeyHash of the circuit, required by
+            HALF_GATES, FIXED_KEY and GRR3.
+        digests: Optional; the digests of the queries given by hash_queries,
+            when they are already computed in a batch with other gates.
     """
 
-    def __init__(self, gate, keys, pbits):
+    def __init__(self, gate, keys, pbits, scheme=CLASSIC, delta=None, hasher=None, digests=None):
         self.keys = keys  # dict of yao circuit keys
         self.pbits = pbits  # dict of p-bits
+        self.scheme = scheme  # garbling scheme
+        self.delta = delta  # global offset of the keys
+        self.hasher = hasher  # fixed-key AES hash
+        self.output_keys = None  # pair of keys of the output, when derived by the gate
         self.input = gate["in"]  # list of inputs'ID
         self.output = gate["id"]  # ID of output
         self.gate_type = gate["type"]  # Gate type: OR, AND, ...
@@ -92,20 +341,18 @@ class GarbledGate:
         self.clear_garbled_table = {}
 
         # Create the garbled table according to the gate type
-        switch = {
-            "OR": lambda b1, b2: b1 or b2,
-            "AND": lambda b1, b2: b1 and b2,
-            "XOR": lambda b1, b2: b1 ^ b2,
-            "NOR": lambda b1, b2: not (b1 or b2),
-            "NAND": lambda b1, b2: not (b1 and b2),
-            "XNOR": lambda b1, b2: not (b1 ^ b2)
-        }
+        if self.scheme in PACKED_SCHEMES and digests is None:
+            digests = self.hasher.hash_many(self.hash_queries(gate, keys, pbits, scheme))
 
+        if self.scheme in HASHED_ROW_SCHEMES:
+            self._gen_hashed_table(GATE_OPERATORS[self.gate_type], digests)
         # NOT gate is a special case since it has only one input
-        if (self.gate_type == "NOT"):
+        elif (self.gate_type == "NOT"):
             self._gen_garbled_table_not()
+        elif self.scheme == HALF_GATES:
+            self._gen_half_gates_table(*HALF_GATE_INVERSIONS[self.gate_type], digests)
         else:
-            operator = switch[self.gate_type]
+            operator = GATE_OPERATORS[self.gate_type]
             self._gen_garbled_table(operator)
 
     def _gen_garbled_table_not(self):
@@ -159,9 +406,107 @@ class GarbledGate:
                     (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
                 ]
 
+    @staticmethod
+    def hash_queries(gate, keys, pbits, scheme):
+        """Return the (key_a, tweak, key_b) queries to the fixed-key AES hash needed by a gate.
+
+        Args:
+            gate: A dict containing gate spec.
+            keys: A dict mapping each wire to a pair of keys.
+            pbits: A dict mapping each wire to its p-bit.
+            scheme: The garbling scheme, one of HALF_GATES, FIXED_KEY or GRR3.
+
+        Returns:
+            The list of queries, in the order expected by the garbling of the gate.
+        """
+        out = gate["id"]
+        if scheme == HALF_GATES:
+            (key_a0, key_a1), (key_b0, key_b1) = keys[gate["in"][0]], keys[gate["in"][1]]
+            return [(key_a0, 2 * out, None), (key_a1, 2 * out, None),
+                    (key_b0, 2 * out + 1, None), (key_b1, 2 * out + 1, None)]
+
+        queries = []
+        for encr_bits in itertools.product((0, 1), repeat=len(gate["in"])):
+            in_keys = [keys[wire][encr_bit ^ pbits[wire]] for encr_bit, wire in zip(encr_bits, gate["in"])]
+            queries.append((in_keys[0], out, in_keys[1] if len(in_keys) > 1 else None))
+        return queries
+
+    def _gen_hashed_table(self, operator, digests):
+        """Create the garbled table of a gate with the fixed-key AES hash.
+
+        Each row is H(key_a, key_b, gate_id) XOR key_out, 16 bytes in total,
+        since the last bit of key_out already is the encrypted output bit.
+        With GRR3 the output key of the row at encrypted index (0, 0) is the
+        hash itself, so that row is all zeros and is not stored: the other
+        output key is random and both keys are returned by get_output_keys.
+
+        Args:
+            operator: The logical function of the gate, with 1 or 2 inputs.
+            digests: The digest of every row, in the order of hash_queries.
+        """
+        out = self.output
+        output_keys = self.keys.get(out)
+        for encr_bits, digest in zip(itertools.product((0, 1), repeat=len(self.input)), digests):
+            bits = [encr_bit ^ self.pbits[wire] for encr_bit, wire in zip(encr_bits, self.input)]
+            bit_out = int(operator(*bits))
+
+            if self.scheme == GRR3 and not any(encr_bits):
+                # The first row fixes the output keys, its last bit is the encrypted bit
+                if output_keys is None:
+                    other_key = set_lsb(get_random_bytes(16), 1 - (digest[-1] & 1))
+                    output_keys = (digest, other_key) if bit_out == 0 else (other_key, digest)
+                self.output_keys = output_keys
+            else:
+                self.garbled_table[encr_bits] = xor_bytes(digest, output_keys[bit_out])
+            self.clear_garbled_table[encr_bits] = list(zip(self.input, bits)) + [
+                (out, bit_out), output_keys[bit_out][-1] & 1
+            ]
+
+    def _gen_half_gates_table(self, invert_a, invert_b, invert_out, digests):
+        """Create the two ciphertexts of a gate with the half gates technique.
+
+        The gate is seen as ((a ^ invert_a) AND (b ^ invert_b)) ^ invert_out, the
+        inversions are free since they only swap the keys of a wire. The AND is
+        split into a garbler half gate, where the garbler knows the p-bit of b,
+        and an evaluator half gate, where the evaluator knows the encrypted bit of b.
+        The key of the output bit 0 is derived from the ciphertexts.
+
+        Args:
+            invert_a: 1 if the first input is inverted before the AND.
+            invert_b: 1 if the second input is inverted before the AND.
+            invert_out: 1 if the output of the AND is inverted.
+            digests: The digests of the keys of bit 0 and 1 of each input,
+                in the order of hash_queries.
+        """
+        in_a, in_b = self.input[0], self.input[1]
+
+        # Inverting an input swaps its keys, and so their digests
+        key_a0 = self.keys[in_a][invert_a]
+        key_b0 = self.keys[in_b][invert_b]
+        hash_a0, hash_a1 = digests[invert_a], digests[1 - invert_a]
+        hash_b0, hash_b1 = digests[2 + invert_b], digests[3 - invert_b]
+        pbit_a, pbit_b = key_a0[-1] & 1, key_b0[-1] & 1
+
+        # Garbler half gate
+        table_g = xor_bytes(hash_a0, hash_a1)
+        if pbit_b:
+            table_g = xor_bytes(table_g, self.delta)
+        key_g0 = xor_bytes(hash_a0, table_g) if pbit_a else hash_a0
+
+        # Evaluator half gate
+        table_e = xor_bytes(xor_bytes(hash_b0, hash_b1), key_a0)
+        key_e0 = xor_bytes(hash_b0, xor_bytes(table_e, key_a0)) if pbit_b else hash_b0
+
+        key_out = xor_bytes(key_g0, key_e0)
+        key_out = xor_bytes(key_out, self.delta) if invert_out else key_out
+        self.output_keys = (key_out, xor_bytes(key_out, self.delta))
+        self.garbled_table = {0: table_g, 1: table_e}
+
     def print_garbled_table(self):
         """Print a clear representation of the garbled table."""
         print(f"GATE: {self.output}, TYPE: {self.gate_type}")
+        if self.scheme == HALF_GATES and self.gate_type != "NOT":
+            print(f"[G]: {self.garbled_table[0].hex()}, [E]: {self.garbled_table[1].hex()}")
         for k, v in self.clear_garbled_table.items():
             # If it's a 2-input gate
             if len(k) > 1:
@@ -180,4 +525,8 @@ class GarbledGate:
 
     def get_garbled_table(self):
         """Return the garbled table of the gate."""
-        return self.garbled_table
\ No newline at end of file
+        return self.garbled_table
+
+    def get_output_keys(self):
+        """Return the pair of keys of the output, if derived by the gate."""
+        return self.output_keys
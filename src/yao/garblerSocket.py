@@ -5,6 +5,10 @@ from util.util import SERVER_HOST, SERVER_PORT
 
 
 class GarblerSocket(Socket):
-    def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
-        super().__init__(zmq.REQ)
+    def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}", pipelined=False, session_id=None):
+        if session_id is None:
+            super().__init__(zmq.PAIR if pipelined else zmq.REQ)
+        else:  # a session of an evaluator server, which routes the messages by session ID
+            super().__init__(zmq.DEALER)
+            self.socket.setsockopt(zmq.IDENTITY, session_id.encode())
         self.socket.connect(endpoint)
@@ -0,0 +1,127 @@
+import collections
+import logging
+import threading
+
+from util.util import GARBLING_POOL_CAPACITY, GARBLING_POOL_LOW_WATER, REFILL_EAGER, REFILL_LOW_WATER
+
+
+class GarblingPool:
+    """Bounded pool of circuits garbled offline, each one used by a single session.
+
+    A background thread garbles circuits for a set of shapes (the
+    parameters a circuit is built from) until each shape has capacity of
+    them, following the refill policy:
+        - REFILL_EAGER: a circuit is garbled as soon as a shape is below
+          capacity, so the pool stays full.
+        - REFILL_LOW_WATER: a shape is left alone until it is down to
+          low_water circuits, then refilled to capacity in one go, so the
+          producer works in bursts.
+    The emptiest shape is refilled first. A session takes a circuit with
+    take, a miss (no circuit ready, or an unknown shape) leaves the garbling
+    to the caller. A shape whose garbling fails once is not garbled again,
+    its circuits ready can still be taken.
+
+    Args:
+        produce: A function garbling a fresh circuit of a shape, e.g.
+            Alice.garble_shape, called by the producer thread.
+        shapes: Optional; the shapes to keep garbled circuits of (none by
+            default).
+        capacity: Optional; the circuits kept for each shape
+            (GARBLING_POOL_CAPACITY by default).
+        policy: Optional; REFILL_EAGER or REFILL_LOW_WATER (REFILL_EAGER by
+            default).
+        low_water: Optional; the circuits left when a shape is refilled with
+            REFILL_LOW_WATER (GARBLING_POOL_LOW_WATER by default).
+        learn_shapes: Optional; also keep circuits of every shape missed
+            by take (False by default).
+    """
+    def __init__(self, produce, shapes=(), capacity=GARBLING_POOL_CAPACITY, policy=REFILL_EAGER,
+                 low_water=GARBLING_POOL_LOW_WATER, learn_shapes=False):
+        if policy not in (REFILL_EAGER, REFILL_LOW_WATER):
+            raise ValueError(f"Unknown refill policy {policy}")
+        self.produce = produce
+        self.capacity = capacity
+        self.policy = policy
+        self.low_water = low_water
+        self.learn_shapes = learn_shapes
+        self.entries = {shape: collections.deque() for shape in shapes}  # shape -> circuits ready
+        self.refilling = set()  # shapes being refilled to capacity, with REFILL_LOW_WATER
+        self.failed = set()  # shapes whose garbling failed, not garbled again
+        self.hits, self.misses, self.produced = collections.Counter(), collections.Counter(), collections.Counter()
+        self.failures = collections.Counter()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._produce_loop, daemon=True)
+        self.thread.start()
+
+    def take(self, shape):
+        """Return a garbled circuit of a shape, removed from the pool, or None on a miss."""
+        with self.condition:
+            entries = self.entries.get(shape)
+            if entries:
+                self.hits[shape] += 1
+                entry = entries.popleft()
+            else:
+                self.misses[shape] += 1
+                entry = None
+                if entries is None and self.learn_shapes:
+                    self.entries[shape] = collections.deque()
+            self.condition.notify()
+            return entry
+
+    def metrics(self):
+        """Return the hits, misses, circuits garbled, failed garblings and circuits ready, in total and by shape,
+        the hit rate and the failed shapes."""
+        with self.condition:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "produced": sum(self.produced.values()),
+                "failures": sum(self.failures.values()),
+                "failed": sorted(self.failed),
+                "ready": {shape: len(entries) for shape, entries in self.entries.items()},
+                "by_shape": {shape: {"hits": self.hits[shape], "misses": self.misses[shape],
+                                     "produced": self.produced[shape], "failures": self.failures[shape]}
+                             for shape in set(self.entries) | set(self.misses)},
+            }
+
+    def close(self):
+        """Stop the producer once the circuit it is garbling is done."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _next_shape(self):
+        """Return the emptiest shape to garble a circuit of with the refill policy, or None."""
+        for shape, entries in self.entries.items():
+            if len(entries) <= self.low_water:
+                self.refilling.add(shape)
+            elif len(entries) >= self.capacity:
+                self.refilling.discard(shape)
+        candidates = [shape for shape, entries in self.entries.items() if len(entries) < self.capacity
+                      and shape not in self.failed and (self.policy == REFILL_EAGER or shape in self.refilling)]
+        return min(candidates, key=lambda shape: len(self.entries[shape]), default=None)
+
+    def _produce_loop(self):
+        while True:
+            with self.condition:
+                shape = self._next_shape()
+                while shape is None and not self.closed:
+                    self.condition.wait()
+                    shape = self._next_shape()
+                if self.closed:
+                    return
+            try:
+                entry = self.produce(shape)  # without the lock, sessions take circuits meanwhile
+            except Exception:
+                logging.exception(f"Garbling of {shape} failed")
+                with self.condition:
+                    self.failed.add(shape)  # no more attempts, the circuits ready stay
+                    self.failures[shape] += 1
+                continue
+            with self.condition:
+                self.entries[shape].append(entry)
+                self.produced[shape] += 1
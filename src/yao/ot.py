@@ -1,10 +1,11 @@
 import hashlib
 import logging
 import pickle
+import secrets
 
-from yao.primeGroup import PrimeGroup
+from yao.primeGroup import get_group
 from util import util
-from util.util import append_to_file
+from util.util import CLASSIC, EVALUATION_WORKERS, OT_EXTENSION, OT_EXTENSION_BASE_OTS, append_to_file
 from util.util import truncate_file
 
 from yao import yao
@@ -13,15 +14,20 @@ from yao import yao
 class ObliviousTransfer:
     def __init__(self, socket, enabled=True):
         self.socket = socket
-        self.enabled = enabled
+        self.enabled = enabled  # True, False or OT_EXTENSION
+        self.extension = enabled == OT_EXTENSION
         self.log_flag = False
 
-    def get_result(self, a_inputs, b_keys):
+    def get_result(self, a_inputs, b_keys, stream=None):
         """Send Alice's inputs and retrieve Bob's result of evaluation.
 
         Args:
             a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
             b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+            stream: Optional; an iterable of the messages carrying the garbled
+                tables chunk by chunk, then the pbits of the outputs, sent
+                once Bob has all the inputs (None if the garbled tables
+                were sent with the circuit).
 
         Returns:
             The result of the yao circuit evaluation.
@@ -29,19 +35,38 @@ class ObliviousTransfer:
         logging.debug("Sending inputs to Bob")
         self.socket.send(a_inputs)
 
-        for _ in range(len(b_keys)):
-            w = self.socket.receive()  # receive gate ID where to perform OT
-            logging.debug(f"Received gate ID {w}")
+        wires = self.socket.receive()  # Bob's wires, in the order of the OTs
+        logging.debug(f"Received {len(wires)} gate IDs")
 
-            if self.enabled:  # perform oblivious transfer
-                pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
-                self.ot_garbler(pair)
+        if self.enabled:  # perform oblivious transfer, for all the wires at once
+            pairs = [(pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1])) for w in wires]
+            if self.extension:
+                self.ot_extension_garbler(pairs)
             else:
-                to_send = (b_keys[w][0], b_keys[w][1])
-                self.socket.send(to_send)
-        return self.socket.receive()
+                self.ot_garbler(pairs)
+        else:
+            self.socket.send([(b_keys[w][0], b_keys[w][1]) for w in wires])
 
-    def send_result(self, circuit, g_tables, pbits_out, b_inputs):
+        if stream is None:
+            return self.socket.receive()
+
+        if self.socket.pipelined:
+            # Each chunk is sent as soon as it is garbled, the socket blocks once PIPELINE_HWM of them are in flight
+            for message in stream:
+                logging.debug("Sending garbled tables")
+                self.socket.send(message)
+            return self.socket.receive()
+
+        self.socket.receive()  # Bob is ready for the garbled tables
+        result = None
+        for message in stream:
+            logging.debug("Sending garbled tables")
+            # Bob acknowledges each chunk before evaluating it, the reply to the pbits is the result
+            result = self.socket.send_wait(message)
+        return result
+
+    def send_result(self, circuit, g_tables, pbits_out, b_inputs, scheme=CLASSIC, workers=EVALUATION_WORKERS,
+                    stream=False):
         """Evaluate circuit and send the result to Alice.
 
         Args:
@@ -49,6 +74,13 @@ class ObliviousTransfer:
             g_tables: Garbled tables of yao circuit.
             pbits_out: p-bits of outputs.
             b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; the garbling scheme of the circuit
+                (CLASSIC by default).
+            workers: Optional; the number of processes evaluating the circuit,
+                or an EvaluationPool (EVALUATION_WORKERS by default).
+            stream: Optional; receive the garbled tables and the pbits of the
+                outputs chunk by chunk after the inputs, and evaluate each
+                chunk as it arrives (False by default).
 
         Returns:
             The result of the yao circuit evaluation.
@@ -60,72 +92,185 @@ class ObliviousTransfer:
 
         logging.debug("Received Alice's inputs")
 
-        for w, b_input in b_inputs.items():
-            logging.debug(f"Sending gate ID {w}")
-            self.socket.send(w)
+        wires = list(b_inputs)
+        logging.debug(f"Sending {len(wires)} gate IDs")
+        self.socket.send(wires)
+        choices = [b_inputs[w] for w in wires]
 
-            if self.enabled:
-                b_inputs_encr[w] = pickle.loads(self.ot_evaluator(b_input))
+        if self.enabled:
+            if self.extension:
+                msgs = self.ot_extension_evaluator(choices)
             else:
-                pair = self.socket.receive()
-                logging.debug(f"Received key pair, key {b_input} selected")
+                msgs = self.ot_evaluator(choices)
+            for w, msg in zip(wires, msgs):
+                b_inputs_encr[w] = pickle.loads(msg)
+        else:
+            pairs = self.socket.receive()
+            logging.debug("Received key pairs")
+            for w, b_input, pair in zip(wires, choices, pairs):
                 b_inputs_encr[w] = pair[b_input]
-        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
-                              b_inputs_encr)
+
+        if stream:
+            result = yao.evaluate_stream(circuit, self.receive_stream(), a_inputs, b_inputs_encr, scheme)
+        else:
+            result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
+                                  b_inputs_encr, scheme, workers)
 
         logging.debug("Sending circuit evaluation")
         self.socket.send(result)
         return result
 
+    def receive_stream(self):
+        """Receive the messages of a garbling stream, up to the pbits of the outputs.
+
+        Each chunk is acknowledged before it is yielded to the evaluator, so
+        Alice garbles and sends the next chunk while this one is evaluated.
+        On a pipelined socket Alice does not wait, so there is nothing to
+        acknowledge.
+
+        Yields:
+            The dict of each chunk of garbled tables, then the dict of the pbits of the outputs.
+        """
+        pipelined = self.socket.pipelined
+        if not pipelined:
+            self.socket.send(True)  # ready for the garbled tables
+        while True:
+            message = self.socket.receive()
+            if "pbits_out" in message:
+                yield message
+                return
+            if not pipelined:
+                self.socket.send(True)
+            yield message
+
     def ot_garbler(self, msgs):
-        """Oblivious transfer, Alice's side.
+        """Oblivious transfer, Alice's side, for many pairs of messages at once.
+
+        A single group is agreed for the whole batch, then every message of
+        the protocol carries the values of all the OTs, each one with its own
+        fresh randomness, so the batch costs 3 round trips.
 
         Args:
-            msgs: A pair (msg1, msg2) to suggest to Bob.
+            msgs: A list of pairs (msg1, msg2) to suggest to Bob.
         """
         logging.debug("OT protocol started")
-        G = PrimeGroup()
+        G = get_group()
         self.socket.send_wait(G)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
-        c = G.gen_pow(G.rand_int())
-        h0 = self.socket.send_wait(c)
-        h1 = G.mul(c, G.inv(h0))
-        k = G.rand_int()
-        c1 = G.gen_pow(k)
-        e0 = util.xor_bytes(msgs[0], self.ot_hash(G.pow(h0, k), len(msgs[0])))
-        e1 = util.xor_bytes(msgs[1], self.ot_hash(G.pow(h1, k), len(msgs[1])))
-
-        self.log_ot("alice suggests to bob the message: " + str((c1, msgs[0], msgs[1])) + "\n")
-        self.socket.send((c1, e0, e1))
+        cs = G.gen_pow_many([G.rand_int() for _ in msgs])
+        h0s = self.socket.send_wait(cs)
+        ks = [G.rand_int() for _ in msgs]
+        encr_msgs = []
+        for (msg0, msg1), c, h0, k, c1 in zip(msgs, cs, h0s, ks, G.gen_pow_many(ks)):
+            h1 = G.mul(c, G.inv(h0))
+            e0 = util.xor_bytes(msg0, self.ot_hash(G.pow(h0, k), len(msg0)))
+            e1 = util.xor_bytes(msg1, self.ot_hash(G.pow(h1, k), len(msg1)))
+            encr_msgs.append((c1, e0, e1))
+            self.log_ot("alice suggests to bob the message: " + str((c1, msg0, msg1)) + "\n")
+
+        self.socket.send(encr_msgs)
         logging.debug("OT protocol ended")
 
-    def ot_evaluator(self, b):
-        """Oblivious transfer, Bob's side.
+    def ot_evaluator(self, choices):
+        """Oblivious transfer, Bob's side, for many choices at once.
 
         Args:
-            b: Bob's input bit used to select one of Alice's messages.
+            choices: The list of Bob's input bits used to select one of each pair of Alice's messages.
 
         Returns:
-            The message selected by Bob.
+            The list of messages selected by Bob.
         """
         logging.debug("OT protocol started")
         G = self.socket.receive()
         self.socket.send(True)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
-        c = self.socket.receive()
-        x = G.rand_int()
-        x_pow = G.gen_pow(x)
-        h = (x_pow, G.mul(c, G.inv(x_pow)))
-        c1, e0, e1 = self.socket.send_wait(h[b])
-        e = (e0, e1)
-        ot_hash = self.ot_hash(G.pow(c1, x), len(e[b]))
-        mb = util.xor_bytes(e[b], ot_hash)
-
-        self.log_ot(f"bob, using the bit {str(b)}, chooses the message: {str(mb)} \n\n")
+        cs = self.socket.receive()
+        xs = [G.rand_int() for _ in choices]
+        hs = []
+        for b, c, x_pow in zip(choices, cs, G.gen_pow_many(xs)):
+            h = (x_pow, G.mul(c, G.inv(x_pow)))
+            hs.append(h[b])
+        encr_msgs = self.socket.send_wait(hs)
+
+        msgs = []
+        for b, x, (c1, e0, e1) in zip(choices, xs, encr_msgs):
+            e = (e0, e1)
+            ot_hash = self.ot_hash(G.pow(c1, x), len(e[b]))
+            mb = util.xor_bytes(e[b], ot_hash)
+            msgs.append(mb)
+            self.log_ot(f"bob, using the bit {str(b)}, chooses the message: {str(mb)} \n\n")
+
         logging.debug("OT protocol ended")
-        return mb
+        return msgs
+
+    def ot_extension_garbler(self, msgs):
+        """OT extension (IKNP), Alice's side: one OT for each pair of messages, from OT_EXTENSION_BASE_OTS base OTs.
+
+        In the base OTs the roles are swapped: Alice chooses with the bits of
+        a secret s one of the two seeds of Bob for every column of the matrix.
+        Row j of the matrix is then t_j ^ (r_j * s), where t_j is known to
+        Bob and r_j is Bob's choice, so each message is masked by the hash of
+        its index and of the row, or of the row ^ s.
+
+        Args:
+            msgs: A list of pairs (msg0, msg1), in the order of Bob's choices.
+        """
+        logging.debug("OT extension started")
+        secret = [secrets.randbits(1) for _ in range(OT_EXTENSION_BASE_OTS)]
+        self.socket.send(True)  # ready for the base OTs
+        seeds = self.ot_evaluator(secret)
+
+        corrections = self.socket.send_wait(True)  # one column u = t ^ G(seed1) ^ r for each base OT
+        n_bytes = (len(msgs) + 7) // 8
+        columns = [self.ot_prg(seed, n_bytes) ^ (correction if secret_bit else 0)
+                   for seed, correction, secret_bit in zip(seeds, corrections, secret)]
+        secret_row = int("".join(str(secret_bit) for secret_bit in secret), 2)
+
+        encr_msgs = []
+        for j, ((msg0, msg1), row) in enumerate(zip(msgs, self.ot_transpose(columns, 8 * n_bytes))):
+            e0 = util.xor_bytes(msg0, self.ot_extension_hash(j, row, len(msg0)))
+            e1 = util.xor_bytes(msg1, self.ot_extension_hash(j, row ^ secret_row, len(msg1)))
+            encr_msgs.append((e0, e1))
+
+        self.log_ot(f"alice extends {OT_EXTENSION_BASE_OTS} base OTs to {len(msgs)} OTs\n")
+        self.socket.send(encr_msgs)
+        logging.debug("OT extension ended")
+
+    def ot_extension_evaluator(self, choices):
+        """OT extension (IKNP), Bob's side.
+
+        Args:
+            choices: The list of Bob's input bits, one for each OT.
+
+        Returns:
+            The list of messages selected by Bob.
+        """
+        logging.debug("OT extension started")
+        n_bytes = (len(choices) + 7) // 8
+        choices_column = int("".join(str(b) for b in choices).ljust(8 * n_bytes, "0") or "0", 2)
+        seeds = [(secrets.token_bytes(16), secrets.token_bytes(16)) for _ in range(OT_EXTENSION_BASE_OTS)]
+        self.socket.receive()  # Alice is ready for the base OTs
+        self.ot_garbler(seeds)
+
+        columns, corrections = [], []
+        for seed0, seed1 in seeds:
+            column = self.ot_prg(seed0, n_bytes)
+            columns.append(column)
+            corrections.append(column ^ self.ot_prg(seed1, n_bytes) ^ choices_column)
+
+        self.socket.receive()  # Alice is ready for the corrections
+        self.socket.send(corrections)
+        encr_msgs = self.socket.receive()
+
+        msgs = []
+        for j, (b, row) in enumerate(zip(choices, self.ot_transpose(columns, 8 * n_bytes))):
+            msgs.append(util.xor_bytes(encr_msgs[j][b], self.ot_extension_hash(j, row, len(encr_msgs[j][b]))))
+
+        self.log_ot(f"bob receives {len(msgs)} messages from {OT_EXTENSION_BASE_OTS} base OTs\n\n")
+        logging.debug("OT extension ended")
+        return msgs
 
     def start_logging(self):
         """
@@ -149,3 +294,22 @@ class ObliviousTransfer:
         key_length = (pub_key.bit_length() + 7) // 8  # key length in bytes
         bytes = pub_key.to_bytes(key_length, byteorder="big")
         return hashlib.shake_256(bytes).digest(msg_length)
+
+    @staticmethod
+    def ot_prg(seed, n_bytes):
+        """Expand a seed of a base OT into a column of n_bytes * 8 bits, as an integer."""
+        return int.from_bytes(hashlib.shake_256(seed).digest(n_bytes), byteorder="big")
+
+    @staticmethod
+    def ot_transpose(columns, n_bits):
+        """Transpose the columns of n_bits bits of the OT extension matrix into its rows, as integers."""
+        if n_bits == 0:
+            return []
+        bit_columns = [format(column, f"0{n_bits}b") for column in columns]
+        return [int("".join(bits), 2) for bits in zip(*bit_columns)]
+
+    @staticmethod
+    def ot_extension_hash(index, row, msg_length):
+        """Hash function for the rows of the OT extension matrix."""
+        data = index.to_bytes(8, byteorder="big") + row.to_bytes(OT_EXTENSION_BASE_OTS // 8, byteorder="big")
+        return hashlib.shake_256(data).digest(msg_length)
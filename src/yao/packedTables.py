@@ -0,0 +1,187 @@
+import itertools
+import pickle
+import struct
+
+from util.util import FREE_GATES, FREE_XOR_SCHEMES, GRR3, HALF_GATES, PACKED_SCHEMES
+
+# magic, version, scheme code, row size, number of gates with rows, number of rows
+HEADER = struct.Struct(">4sBBHII")
+MAGIC = b"YGPT"
+VERSION = 1
+ROW_SIZE = 16
+
+
+def rows_per_gate(gate, scheme):
+    """Return how many rows of the packed buffer belong to a gate."""
+    if scheme in FREE_XOR_SCHEMES and gate["type"] in FREE_GATES:
+        return 0
+    if scheme == HALF_GATES:
+        return 2
+    rows = 2 ** len(gate["in"])
+    return rows - 1 if scheme == GRR3 else rows
+
+
+def row_keys(n_inputs, scheme):
+    """Return the keys of the garbled table of a gate, in the order they are packed."""
+    if scheme == HALF_GATES:
+        return [0, 1]
+    keys = list(itertools.product((0, 1), repeat=n_inputs))
+    return keys[1:] if scheme == GRR3 else keys
+
+
+def pack_garbled_tables(gates, garbled_tables, scheme):
+    """Pack the garbled tables of a circuit into one contiguous buffer.
+
+    The buffer is a small header followed by the 16 bytes rows of every gate,
+    gate after gate in topological order and row after row in the order of
+    row_keys, so the evaluator finds each row from the circuit alone.
+
+    Args:
+        gates: The list of gates of the circuit.
+        garbled_tables: A dict mapping each gate to its garbled table.
+        scheme: The garbling scheme, one of PACKED_SCHEMES.
+
+    Returns:
+        The packed garbled tables as bytes.
+    """
+    if scheme not in PACKED_SCHEMES:
+        raise ValueError(f"The garbling scheme {scheme} has rows of variable size and cannot be packed")
+
+    rows, n_gates = [], 0
+    for gate in sorted(gates, key=lambda g: g["id"]):
+        if rows_per_gate(gate, scheme) == 0:
+            continue
+        table = garbled_tables[gate["id"]]
+        rows.extend(table[key] for key in row_keys(len(gate["in"]), scheme))
+        n_gates += 1
+
+    header = HEADER.pack(MAGIC, VERSION, PACKED_SCHEMES.index(scheme), ROW_SIZE, n_gates, len(rows))
+    return header + b"".join(rows)
+
+
+def split_packed_tables(buffer, gates, chunk_size):
+    """Split packed garbled tables into the packed tables of chunks of gates, as garbled chunk by chunk.
+
+    Args:
+        buffer: The packed garbled tables of the whole circuit.
+        gates: The list of gates of the circuit.
+        chunk_size: The number of gates of each chunk, in topological order.
+
+    Returns:
+        A generator of the gates of each chunk along with their packed garbled tables.
+    """
+    buffer = memoryview(buffer)
+    magic, version, scheme_code, row_size, _, _ = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("The buffer does not contain packed garbled tables")
+    scheme = PACKED_SCHEMES[scheme_code]
+    gates = sorted(gates, key=lambda g: g["id"])
+
+    offset = HEADER.size
+    for start in range(0, len(gates), chunk_size):
+        chunk = gates[start:start + chunk_size]
+        rows = [rows_per_gate(gate, scheme) for gate in chunk]
+        end = offset + sum(rows) * row_size
+        header = HEADER.pack(MAGIC, VERSION, scheme_code, row_size, sum(map(bool, rows)), sum(rows))
+        yield chunk, header + buffer[offset:end]
+        offset = end
+
+
+class PackedTables:
+    """Read-only view of packed garbled tables, indexed by gate ID like the dict of garbled tables.
+
+    Rows are memoryview slices of the received buffer, nothing is copied or unpickled.
+
+    Args:
+        buffer: The packed garbled tables.
+        gates: The list of gates of the circuit.
+    """
+
+    def __init__(self, buffer, gates):
+        self.buffer = memoryview(buffer)
+        magic, version, scheme_code, row_size, n_gates, n_rows = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("The buffer does not contain packed garbled tables")
+        self.scheme = PACKED_SCHEMES[scheme_code]
+        self.row_size = row_size
+        self.offsets = {}  # dict mapping each gate with rows to (offset, number of inputs)
+
+        offset = HEADER.size
+        for gate in sorted(gates, key=lambda g: g["id"]):
+            n_gate_rows = rows_per_gate(gate, self.scheme)
+            if n_gate_rows:
+                self.offsets[gate["id"]] = (offset, len(gate["in"]))
+                offset += n_gate_rows * row_size
+
+        if len(self.offsets) != n_gates or offset != HEADER.size + n_rows * row_size or offset != len(self.buffer):
+            raise ValueError("The packed garbled tables do not match the circuit")
+
+    def __getstate__(self):
+        """A memoryview cannot be pickled, the buffer is pickled as bytes."""
+        state = dict(self.__dict__)
+        state["buffer"] = pickle.PickleBuffer(self.buffer)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buffer = memoryview(self.buffer)
+
+    def __getitem__(self, gate_id):
+        offset, n_inputs = self.offsets[gate_id]
+        return PackedGateTable(self.buffer, offset, n_inputs, self.scheme, self.row_size)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def items(self):
+        """Yield each gate ID along with its garbled table."""
+        for gate_id in self.offsets:
+            yield gate_id, self[gate_id]
+
+
+class PackedGateTable:
+    """Garbled table of a single gate inside a packed buffer, with the same keys as the dict tables.
+
+    Args:
+        buffer: The packed garbled tables.
+        offset: The offset of the first row of the gate.
+        n_inputs: The number of inputs of the gate.
+        scheme: The garbling scheme.
+        row_size: The size of every row.
+    """
+
+    def __init__(self, buffer, offset, n_inputs, scheme, row_size=ROW_SIZE):
+        self.buffer = buffer
+        self.offset = offset
+        self.n_inputs = n_inputs
+        self.scheme = scheme
+        self.row_size = row_size
+
+    def _position(self, key):
+        """Return the position of a row in the gate, or None if the row is not stored."""
+        if self.scheme == HALF_GATES:
+            return key
+        position = 0
+        for encr_bit in key:
+            position = 2 * position + encr_bit
+        if self.scheme == GRR3:
+            return position - 1 if position else None
+        return position
+
+    def get(self, key, default=None):
+        position = self._position(key)
+        if position is None:
+            return default
+        start = self.offset + position * self.row_size
+        return self.buffer[start:start + self.row_size]
+
+    def __getitem__(self, key):
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def items(self):
+        """Yield each key of the table along with its row."""
+        for key in row_keys(self.n_inputs, self.scheme):
+            yield key, bytes(self[key])
@@ -1,17 +1,125 @@
+import functools
+import json
+import os
 import random
 
 import sympy
 
-from util.util import gen_prime, PRIME_BITS
+from util.util import gen_prime, gen_safe_prime, parse_json, write_to_file
+from util.util import FIXED_BASE_MIN_BITS, FIXED_BASE_WINDOW, PRIME_BITS, PRIME_GROUP_CACHE
+
+# Safe primes p = 2q + 1 of the MODP groups of RFC 3526, by bit size, all with generator 2
+MODP_GROUPS = {
+    1536: int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+        "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+        "83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA237327FFFFFFFFFFFFFFFF", 16),
+    2048: int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+        "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+        "83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+        "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+        "15728E5A8AACAA68FFFFFFFFFFFFFFFF", 16),
+    3072: int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+        "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+        "83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+        "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+        "15728E5A8AAAC42DAD33170D04507A33A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7"
+        "ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864D87602733EC86A64521F2B18177B200C"
+        "BBE117577A615D6C770988C0BAD946E208E24FA074E5AB3143DB5BFCE0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF", 16),
+}
+MODP_GENERATOR = 2
+
+
+def get_group(num_bits=PRIME_BITS, cache_path=PRIME_GROUP_CACHE):
+    """Return a group of prime modulus of the given size, without any prime generation when possible.
+
+    The sizes of the RFC 3526 groups use those fixed groups, the other sizes
+    use a safe prime group generated once and stored in a JSON cache on disk,
+    then every group is kept in memory for the next calls, along with the
+    tables of its generator powers. A cached group that is not a safe prime
+    group of the given size, or a cache that cannot be read, is generated
+    again and overwritten.
+
+    Args:
+        num_bits: The bit size of the prime.
+        cache_path: The path of the cache of the generated groups,
+            relative to the src folder.
+
+    Returns:
+        The PrimeGroup.
+    """
+    return _load_group(num_bits, cache_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_group(num_bits, cache_path):
+    """Return the group of get_group, only called once for each size and cache."""
+    if num_bits in MODP_GROUPS:
+        return PrimeGroup(MODP_GROUPS[num_bits], MODP_GENERATOR)
+
+    # Relative to the src folder, as write_to_file, whatever the working directory
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cache_path = os.path.normpath(os.path.join(base_path, cache_path))
+    try:
+        cache = parse_json(cache_path) if os.path.exists(cache_path) else {}
+    except ValueError:  # truncated or not JSON
+        cache = {}
+    if not isinstance(cache, dict):
+        cache = {}
+    group = _cached_group(cache.get(str(num_bits)), num_bits)
+    if group is not None:
+        return group
+
+    # With a safe prime p = 2q + 1 the factors of p - 1 are known, nothing to factor
+    prime = gen_safe_prime(num_bits)
+    group = PrimeGroup(prime, factors=(2, (prime - 1) // 2))
+    cache[str(num_bits)] = {"prime": format(group.prime, "x"), "generator": format(group.generator, "x")}
+    write_to_file(cache_path, json.dumps(cache, indent=4) + "\n")
+    return group
+
+
+def _cached_group(entry, num_bits):
+    """Return the PrimeGroup of a cache entry, or None if it is not a safe prime group of num_bits bits."""
+    try:
+        prime, generator = int(entry["prime"], 16), int(entry["generator"], 16)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if prime.bit_length() != num_bits or not (sympy.isprime(prime) and sympy.isprime((prime - 1) // 2)):
+        return None
+    # Not of order 1 or 2, nor of order (p - 1) / 2, so a generator of the whole group as find_generator gives
+    if not 1 < generator < prime - 1 or pow(generator, (prime - 1) // 2, prime) == 1:
+        return None
+    return PrimeGroup(prime, generator)
 
 
 class PrimeGroup:
-    """Cyclic abelian group of prime order 'prime'."""
-    def __init__(self, prime=None):
+    """Cyclic abelian group of prime order 'prime'.
+
+    Args:
+        prime: Optional; the prime modulus, a random prime of PRIME_BITS bits
+            if None.
+        generator: Optional; a known generator of the group, a random one is
+            found if None.
+        factors: Optional; the prime factors of prime - 1, used to find the
+            generator, they are computed if None.
+    """
+    def __init__(self, prime=None, generator=None, factors=None):
         self.prime = prime or gen_prime(num_bits=PRIME_BITS)
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
-        self.generator = self.find_generator()
+        self.generator = generator or self.find_generator(factors)
+        self.gen_table = None  # powers of the generator, built by the first gen_pow of a large group
+
+    def __getstate__(self):
+        """The tables of the generator are not sent along with the group, each side builds its own."""
+        state = dict(self.__dict__)
+        state["gen_table"] = None
+        return state
 
     def mul(self, num1, num2):
         "Multiply two elements." ""
@@ -22,20 +130,56 @@ class PrimeGroup:
         return pow(base, exponent, self.prime)
 
     def gen_pow(self, exponent):  # generator exponentiation
-        "Compute nth power of a generator." ""
-        return pow(self.generator, exponent, self.prime)
+        """Compute nth power of a generator.
+
+        In groups of at least FIXED_BASE_MIN_BITS bits the powers
+        generator ^ (digit * 2 ^ (FIXED_BASE_WINDOW * i)) are computed once,
+        then every exponentiation is a product of one entry per window of
+        FIXED_BASE_WINDOW bits of the exponent, with no squaring.
+        """
+        if self.prime.bit_length() < FIXED_BASE_MIN_BITS:
+            return pow(self.generator, exponent, self.prime)
+        if self.gen_table is None:
+            self.gen_table = self._gen_fixed_base_table()
+
+        if exponent >> (FIXED_BASE_WINDOW * len(self.gen_table)):
+            exponent %= self.prime_m1  # the order of the generator divides prime - 1
+        result, mask = 1, (1 << FIXED_BASE_WINDOW) - 1
+        for powers in self.gen_table:
+            if not exponent:
+                break
+            digit = exponent & mask
+            if digit:
+                result = result * powers[digit] % self.prime
+            exponent >>= FIXED_BASE_WINDOW
+        return result
+
+    def gen_pow_many(self, exponents):
+        """Compute the powers of a generator for a list of exponents."""
+        return [self.gen_pow(exponent) for exponent in exponents]
+
+    def _gen_fixed_base_table(self):
+        """Return, for every window of the exponents, the powers of the generator for each digit of the window."""
+        table, base = [], self.generator  # base = generator ^ (2 ^ (FIXED_BASE_WINDOW * i))
+        for _ in range(-(-self.prime.bit_length() // FIXED_BASE_WINDOW)):
+            powers = [1]
+            for _ in range((1 << FIXED_BASE_WINDOW) - 1):
+                powers.append(powers[-1] * base % self.prime)
+            table.append(powers)
+            base = powers[-1] * base % self.prime
+        return table
 
     def inv(self, num):
         "Multiplicative inverse of an element." ""
-        return pow(num, self.prime_m2, self.prime)
+        return pow(num, -1, self.prime)
 
     def rand_int(self):  # random int in [1, prime-1]
         "Return an random int in [1, prime - 1]." ""
         return random.randint(1, self.prime_m1)
 
-    def find_generator(self):  # find random generator for group
+    def find_generator(self, factors=None):  # find random generator for group
         """Find a random generator for the group."""
-        factors = sympy.primefactors(self.prime_m1)
+        factors = factors or sympy.primefactors(self.prime_m1)
 
         while True:
             candidate = self.rand_int()
@@ -1,9 +1,24 @@
+import collections
+import multiprocessing
 import pickle
+from multiprocessing import resource_tracker, shared_memory
 
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad, unpad
 
+from util.util import (CLASSIC, EVALUATION_WORKERS, FREE_XOR_SCHEMES, HALF_GATES, HASHED_ROW_SCHEMES,
+                       PARALLEL_MIN_GATES, PARALLEL_MIN_LEVEL_GATES, xor_bytes)
+from yao.circuitProgram import FREE_OPCODES, NO_WIRE, NOT_OPCODE, CircuitProgram
+from yao.fixedKeyHash import FixedKeyHash
+from yao.packedTables import PackedTables
+
+KEY_SIZE = 16
+WIRE_LABEL_SIZE = KEY_SIZE + 1  # key followed by its encrypted bit, in the shared wire labels
+
+_worker = {}  # state of an evaluation worker process, the circuit of its current evaluation
+ProgramArrays = collections.namedtuple("ProgramArrays", "ids opcodes in_a in_b")  # what a worker needs of a program
+
 
 def encrypt(key, data):
     """Encrypt a message.
@@ -40,49 +55,336 @@ def decrypt(key, data):
     return unpadded_msg
 
 
-def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
-    """Evaluate yao circuit with given inputs.
+def evaluate_hashed_row(gate_id, g_table, label_a, label_b, hasher):
+    """Evaluate a gate whose rows are fixed-key hashes XOR the output key.
+
+    Args:
+        gate_id: The ID of the gate.
+        g_table: The garbled table of the gate.
+        label_a: The (key, encr_bit) of the first input.
+        label_b: The (key, encr_bit) of the second input, None for a NOT gate.
+        hasher: The FixedKeyHash of the circuit.
+
+    Returns:
+        The (key, encr_bit) of the gate output.
+    """
+    if label_b is None:
+        key_out = hasher.hash(label_a[0], gate_id)
+        encr_bits = (label_a[1],)
+    else:
+        key_out = hasher.hash(label_a[0], gate_id, label_b[0])
+        encr_bits = (label_a[1], label_b[1])
+    # With GRR3 the row at encrypted index (0, 0) is all zeros and it is not sent
+    row = g_table.get(encr_bits)
+    if row is not None:
+        key_out = xor_bytes(key_out, row)
+    # The last bit of the output key is its encrypted bit
+    return key_out, key_out[-1] & 1
+
+
+def evaluate_half_gates(gate_id, g_table, label_a, label_b, hasher):
+    """Evaluate an AND, OR, NAND or NOR gate garbled with the half gates technique.
 
     Args:
-        circuit: A dict containing circuit spec.
+        gate_id: The ID of the gate.
+        g_table: The two ciphertexts of the gate.
+        label_a: The (key, encr_bit) of the first input.
+        label_b: The (key, encr_bit) of the second input.
+        hasher: The FixedKeyHash of the circuit.
+
+    Returns:
+        The (key, encr_bit) of the gate output.
+    """
+    key_a, encr_bit_a = label_a
+    key_b, encr_bit_b = label_b
+    table_g, table_e = g_table[0], g_table[1]
+
+    key_g = hasher.hash(key_a, 2 * gate_id)
+    if encr_bit_a:
+        key_g = xor_bytes(key_g, table_g)
+    key_e = hasher.hash(key_b, 2 * gate_id + 1)
+    if encr_bit_b:
+        key_e = xor_bytes(key_e, xor_bytes(table_e, key_a))
+
+    # Inversions of the inputs and of the output are already in the garbler's keys
+    key_out = xor_bytes(key_g, key_e)
+    return key_out, key_out[-1] & 1
+
+
+def evaluate_free_gate(label_a, label_b):
+    """Evaluate a XOR, XNOR or NOT gate garbled with a global offset.
+
+    Args:
+        label_a: The (key, encr_bit) of the first input.
+        label_b: The (key, encr_bit) of the second input, None for a NOT gate.
+
+    Returns:
+        The (key, encr_bit) of the gate output.
+    """
+    # The offset added by XNOR and NOT is already in the garbler's keys
+    if label_b is None:
+        return label_a
+    return xor_bytes(label_a[0], label_b[0]), label_a[1] ^ label_b[1]
+
+
+def evaluate_classic_gate(g_table, label_a, label_b):
+    """Evaluate a gate whose rows are the pickled output label, encrypted with the input keys.
+
+    Args:
+        g_table: The garbled table of the gate.
+        label_a: The (key, encr_bit) of the first input.
+        label_b: The (key, encr_bit) of the second input, None for a NOT gate.
+
+    Returns:
+        The (key, encr_bit) of the gate output.
+    """
+    key_a, encr_bit_a = label_a
+    # Special case if it's a NOT gate
+    if label_b is None:
+        # Fetch the encrypted message in the gate's garbled table and decrypt it
+        return pickle.loads(decrypt(key_a, g_table[(encr_bit_a,)]))
+    # Else the gate has two input wires (same model)
+    key_b, encr_bit_b = label_b
+    encr_msg = g_table[(encr_bit_a, encr_bit_b)]
+    return pickle.loads(decrypt(key_b, decrypt(key_a, encr_msg)))
+
+
+def evaluate_gate(gate_id, opcode, label_a, label_b, g_tables, scheme, hasher):
+    """Evaluate a single gate of a circuit program.
+
+    Args:
+        gate_id: The ID of the gate.
+        opcode: The opcode of the gate.
+        label_a: The (key, encr_bit) of the first input.
+        label_b: The (key, encr_bit) of the second input, None for a NOT gate.
         g_tables: The yao circuit garbled tables.
+        scheme: The garbling scheme used by the garbler.
+        hasher: The FixedKeyHash shared by the gates of the circuit.
+
+    Returns:
+        The (key, encr_bit) of the gate output.
+    """
+    # Free gates have no garbled table, their output is computed directly
+    if opcode in FREE_OPCODES and scheme in FREE_XOR_SCHEMES:
+        return evaluate_free_gate(label_a, label_b)
+    if scheme == HALF_GATES:
+        return evaluate_half_gates(gate_id, g_tables[gate_id], label_a, label_b, hasher)
+    if scheme in HASHED_ROW_SCHEMES:
+        return evaluate_hashed_row(gate_id, g_tables[gate_id], label_a, label_b, hasher)
+    return evaluate_classic_gate(g_tables[gate_id], label_a, label_b)
+
+
+def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs, scheme=CLASSIC, workers=EVALUATION_WORKERS):
+    """Evaluate yao circuit with given inputs.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CircuitProgram.
+        g_tables: The yao circuit garbled tables, as a dict or as a packed buffer.
         pbits_out: The pbits of outputs.
         a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
         b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the garbling scheme used by the garbler
+            (CLASSIC by default).
+        workers: Optional; the number of processes evaluating the circuit,
+            or an EvaluationPool reused across evaluations, circuits smaller
+            than PARALLEL_MIN_GATES are always evaluated serially
+            (EVALUATION_WORKERS by default).
 
     Returns:
         A dict mapping output wires with their result bit.
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
-
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
-
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
-        # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
-            # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in,)]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
-        # Else the gate has two input wires (same model)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
-            msg = decrypt(key_b, decrypt(key_a, encr_msg))
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
+    program = circuit if isinstance(circuit, CircuitProgram) else CircuitProgram(circuit)
+    pool = workers if isinstance(workers, EvaluationPool) else None
+    if (pool.workers if pool else workers) > 1 and len(program) >= PARALLEL_MIN_GATES:
+        if pool is not None:
+            return pool.evaluate(program, g_tables, pbits_out, a_inputs, b_inputs, scheme)
+        pool = EvaluationPool(workers)  # only for this evaluation
+        try:
+            return pool.evaluate(program, g_tables, pbits_out, a_inputs, b_inputs, scheme)
+        finally:
+            pool.close()
+
+    labels = input_labels(program, a_inputs, b_inputs)
+    evaluate_gates(program, 0, len(program), g_tables, labels, scheme, FixedKeyHash())
 
     # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ pbits_out[out]
+    return {out: labels[out][1] ^ pbits_out[out] for out in program.outputs}
+
+
+def evaluate_stream(circuit, messages, a_inputs, b_inputs, scheme=CLASSIC):
+    """Evaluate yao circuit while its garbled tables arrive chunk by chunk.
+
+    Each chunk is evaluated as soon as it arrives and then dropped, so only
+    one chunk of garbled tables is in memory at a time.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CircuitProgram.
+        messages: An iterable of the messages of the garbler: a dict with the
+            "n_gates" and the "garbled_tables" of the next gates in program
+            order for each chunk, then a dict with the "pbits_out".
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the garbling scheme used by the garbler
+            (CLASSIC by default).
+
+    Returns:
+        A dict mapping output wires with their result bit.
+    """
+    program = circuit if isinstance(circuit, CircuitProgram) else CircuitProgram(circuit)
+    labels = input_labels(program, a_inputs, b_inputs)
+    hasher = FixedKeyHash()  # a single AES instance for the whole circuit
+    start = 0
+
+    for message in messages:
+        if "pbits_out" in message:
+            pbits_out = message["pbits_out"]
+            return {out: labels[out][1] ^ pbits_out[out] for out in program.outputs}
+        end = start + message["n_gates"]
+        evaluate_gates(program, start, end, message["garbled_tables"], labels, scheme, hasher)
+        start = end
+
+    raise ValueError("The garbler stopped before sending the pbits of the outputs")
+
+
+def input_labels(program, a_inputs, b_inputs):
+    """Return the list of wire labels of a program, indexed by wire ID, with only the inputs set."""
+    labels = [None] * program.n_wires  # (key, encr_bit) of each evaluated wire
+    for wire, label in list(a_inputs.items()) + list(b_inputs.items()):
+        labels[wire] = label
+    return labels
+
+
+def evaluate_gates(program, start, end, g_tables, labels, scheme, hasher):
+    """Evaluate the gates program[start:end], whose inputs are already in labels.
+
+    Args:
+        program: The CircuitProgram of the circuit.
+        start: The position of the first gate to evaluate.
+        end: The position after the last gate to evaluate.
+        g_tables: The garbled tables of the gates, as a dict or as a packed buffer.
+        labels: The list of (key, encr_bit) of the wires, indexed by wire ID,
+            the outputs of the gates are stored in it.
+        scheme: The garbling scheme used by the garbler.
+        hasher: The FixedKeyHash shared by the gates of the circuit.
+    """
+    # Rows of packed tables are read in place from the buffer
+    if isinstance(g_tables, (bytes, bytearray, memoryview)):
+        g_tables = PackedTables(g_tables, program.gates[start:end])
+
+    # Run the program, the inputs of each gate are evaluated before it
+    for gate_id, opcode, in_a, in_b in zip(program.ids[start:end], program.opcodes[start:end],
+                                           program.in_a[start:end], program.in_b[start:end]):
+        label_b = None if opcode == NOT_OPCODE else labels[in_b]
+        labels[gate_id] = evaluate_gate(gate_id, opcode, labels[in_a], label_b, g_tables, scheme, hasher)
+
+
+def _read_label(labels, wire):
+    """Return the (key, encr_bit) of a wire from the shared wire labels."""
+    if wire == NO_WIRE:
+        return None
+    offset = wire * WIRE_LABEL_SIZE
+    return bytes(labels[offset:offset + KEY_SIZE]), labels[offset + KEY_SIZE]
+
+
+def _write_label(labels, wire, label):
+    """Store the (key, encr_bit) of a wire in the shared wire labels."""
+    offset = wire * WIRE_LABEL_SIZE
+    key, encr_bit = label
+    labels[offset:offset + KEY_SIZE] = key
+    labels[offset + KEY_SIZE] = encr_bit
+
+
+def _evaluate_positions(program, positions, g_tables, labels, scheme, hasher):
+    """Evaluate the gates at the given positions of a program, on the shared wire labels."""
+    ids, opcodes, in_a, in_b = program.ids, program.opcodes, program.in_a, program.in_b
+    for i in positions:
+        label = evaluate_gate(ids[i], opcodes[i], _read_label(labels, in_a[i]), _read_label(labels, in_b[i]),
+                              g_tables, scheme, hasher)
+        _write_label(labels, ids[i], label)
+
+
+def _load_worker(state_name, state_size, labels_name):
+    """Load the circuit of an evaluation in a worker, on its first slice of the evaluation."""
+    if "labels" in _worker:  # the circuit of the previous evaluation
+        _worker["labels"].release()
+        _worker["state_memory"].close()
+        _worker["labels_memory"].close()
+    state_memory = shared_memory.SharedMemory(state_name)
+    labels_memory = shared_memory.SharedMemory(labels_name)
+    program, g_tables, scheme = pickle.loads(state_memory.buf[:state_size])
+    _worker.update(name=state_name, state_memory=state_memory, labels_memory=labels_memory,
+                   labels=labels_memory.buf.cast("B"), program=program, g_tables=g_tables, scheme=scheme,
+                   hasher=_worker.get("hasher") or FixedKeyHash())
+
+
+def _evaluate_worker_slice(state_name, state_size, labels_name, positions):
+    """Evaluate the gates at the given positions of the program of an evaluation in a worker."""
+    if _worker.get("name") != state_name:
+        _load_worker(state_name, state_size, labels_name)
+    _evaluate_positions(_worker["program"], positions, _worker["g_tables"], _worker["labels"], _worker["scheme"],
+                        _worker["hasher"])
+
+
+class EvaluationPool:
+    """Pool of processes evaluating circuits level by level, started once and reused by every evaluation.
+
+    The topological levels come with the program. Wire labels live in one
+    shared memory block indexed by wire ID, and each level is a barrier for
+    the next one. The arrays of the program and the garbled tables are
+    pickled once per evaluation into another shared memory block, which
+    each worker loads on its first slice of the evaluation, so only the
+    positions of each slice of a level go through the pool. Levels narrower
+    than PARALLEL_MIN_LEVEL_GATES are evaluated by the calling process.
+
+    Args:
+        workers: Optional; the number of processes of the pool
+            (EVALUATION_WORKERS by default).
+    """
+    def __init__(self, workers=EVALUATION_WORKERS):
+        self.workers = workers
+        self.pool = None  # started by the first evaluation
+
+    def evaluate(self, program, g_tables, pbits_out, a_inputs, b_inputs, scheme):
+        """Evaluate a CircuitProgram, the arguments are those of evaluate.
+
+        Returns:
+            A dict mapping output wires with their result bit.
+        """
+        if self.pool is None:
+            resource_tracker.ensure_running()  # shared with the workers, which attach to the blocks unlinked here
+            self.pool = multiprocessing.Pool(self.workers)
+
+        if isinstance(g_tables, (bytes, bytearray, memoryview)):
+            g_tables = PackedTables(g_tables, program.gates)
+        arrays = ProgramArrays(program.ids, program.opcodes, program.in_a, program.in_b)
+        state = pickle.dumps((arrays, g_tables, scheme), protocol=5)
+        state_memory = shared_memory.SharedMemory(create=True, size=len(state))
+        labels_memory = shared_memory.SharedMemory(create=True, size=max(program.n_wires * WIRE_LABEL_SIZE, 1))
+        labels = labels_memory.buf.cast("B")
+        try:
+            state_memory.buf[:len(state)] = state
+            for wire, label in list(a_inputs.items()) + list(b_inputs.items()):
+                _write_label(labels, wire, label)
+
+            hasher = FixedKeyHash()
+            for positions in program.levels:
+                if len(positions) < PARALLEL_MIN_LEVEL_GATES:
+                    _evaluate_positions(arrays, positions, g_tables, labels, scheme, hasher)
+                else:
+                    step = -(-len(positions) // self.workers)
+                    self.pool.starmap(_evaluate_worker_slice,
+                                      [(state_memory.name, len(state), labels_memory.name, positions[start:start + step])
+                                       for start in range(0, len(positions), step)])
+
+            return {out: _read_label(labels, out)[1] ^ pbits_out[out] for out in program.outputs}
+        finally:
+            labels.release()
+            for memory in (state_memory, labels_memory):
+                memory.close()
+                memory.unlink()
 
-    return evaluation
+    def close(self):
+        """Stop the processes of the pool."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
@@ -1,31 +1,39 @@
+import logging
 from abc import ABC
 
-from util.util import parse_json
+from util.util import CLASSIC, PACKED_SCHEMES, parse_json
 
 from yao import garbledCircuit
+from yao.circuitOptimizer import optimize_circuit
+from yao.packedTables import pack_garbled_tables, split_packed_tables
 
 
 class YaoGarbler(ABC):
-    """An abstract class for Yao garblers (e.g. Alice)."""
-    def __init__(self, circuits):
+    """An abstract class for Yao garblers (e.g. Alice).
+
+    Args:
+        circuits: the path of a JSON file with the circuits to garble, or None.
+        scheme: Optional; the garbling scheme used for every circuit
+            (CLASSIC by default).
+        chunk_size: Optional; stream the garbled tables to the evaluator in
+            chunks of this many gates, each garbled while the previous one is
+            evaluated, or garble and send all the tables at once if None
+            (None by default).
+        optimize: Optional; replace each circuit by the equivalent one of
+            optimize_circuit before garbling it, the evaluator gets the
+            optimized circuit (False by default).
+    """
+    def __init__(self, circuits, scheme=CLASSIC, chunk_size=None, optimize=False):
         self.circuits = []
+        self.scheme = scheme
+        self.chunk_size = chunk_size
+        self.optimize = optimize
         if circuits is not None:
             circuits = parse_json(circuits)
             self.name = circuits["name"]
 
             for circuit in circuits["circuits"]:
-                garbled_circuit = garbledCircuit.GarbledCircuit(circuit)
-                pbits = garbled_circuit.get_pbits()
-                entry = {
-                    "circuit": circuit,
-                    "garbled_circuit": garbled_circuit,
-                    "garbled_tables": garbled_circuit.get_garbled_tables(),
-                    "keys": garbled_circuit.get_keys(),
-                    "pbits": pbits,
-                    "pbits_out": {w: pbits[w]
-                                  for w in circuit["out"]},
-                }
-                self.circuits.append(entry)
+                self.circuits.append(self._garble(circuit))
 
     def update_circuits(self, circuits):
         """
@@ -35,15 +43,62 @@ class YaoGarbler(ABC):
         """
         if circuits is not None:
             for circuit in circuits["circuits"]:
-                garbled_circuit = garbledCircuit.GarbledCircuit(circuit)
-                pbits = garbled_circuit.get_pbits()
-                entry = {
-                    "circuit": circuit,
-                    "garbled_circuit": garbled_circuit,
-                    "garbled_tables": garbled_circuit.get_garbled_tables(),
-                    "keys": garbled_circuit.get_keys(),
-                    "pbits": pbits,
-                    "pbits_out": {w: pbits[w]
-                                  for w in circuit["out"]},
-                }
-                self.circuits.append(entry)
+                self.circuits.append(self._garble(circuit))
+
+    def _garble(self, circuit):
+        """
+        Garble a circuit, optimized first if optimize is set, when streaming only the keys of the inputs are
+        created, the garbled tables and the pbits of the outputs come later with stream_garbled_tables
+        Args:
+            circuit: the circuit to garble
+
+        Returns:
+            the entry of the circuit in the circuit list of the garbler
+        """
+        report = None
+        if self.optimize:
+            circuit, report = optimize_circuit(circuit)
+            logging.info(f"Optimized {circuit['id']}: {report['gates_before'] - report['gates_after']} gates removed "
+                         f"of {report['gates_before']} in {report['seconds']:.3f}s")
+
+        stream = self.chunk_size is not None
+        garbled_circuit = garbledCircuit.GarbledCircuit(circuit, scheme=self.scheme, garble=not stream)
+        pbits = garbled_circuit.get_pbits()
+        return {
+            "circuit": circuit,
+            "garbled_circuit": garbled_circuit,
+            "garbled_tables": None if stream else garbled_circuit.get_garbled_tables(),
+            "keys": garbled_circuit.get_keys(),
+            "pbits": pbits,
+            "pbits_out": None if stream else {w: pbits[w] for w in circuit["out"]},
+            "scheme": self.scheme,
+            "optimization": report,
+        }
+
+    def stream_garbled_tables(self, entry):
+        """
+        Garble a circuit chunk by chunk, with a scheme that has fixed size rows each chunk is packed. A circuit
+        loaded from an artifact is garbled already, its packed tables are split in chunks
+        Args:
+            entry: the entry of the circuit in the circuit list of the garbler
+
+        Returns:
+            a generator of the messages to send to the evaluator: the garbled tables of each chunk, with the
+            number of gates of the chunk, and finally the pbits of the outputs
+        """
+        garbled_circuit = entry["garbled_circuit"]
+        if garbled_circuit is None:  # loaded from an artifact
+            for gates, garbled_tables in split_packed_tables(entry["garbled_tables"], entry["circuit"]["gates"],
+                                                             self.chunk_size):
+                yield {"n_gates": len(gates), "garbled_tables": garbled_tables}
+            yield {"pbits_out": entry["pbits_out"]}
+            return
+
+        for gates, garbled_tables in garbled_circuit.garble_chunks(self.chunk_size):
+            if self.scheme in PACKED_SCHEMES:
+                garbled_tables = pack_garbled_tables(gates, garbled_tables, self.scheme)
+            yield {"n_gates": len(gates), "garbled_tables": garbled_tables}
+
+        pbits = garbled_circuit.get_pbits()
+        entry["pbits_out"] = {w: pbits[w] for w in entry["circuit"]["out"]}
+        yield {"pbits_out": entry["pbits_out"]}